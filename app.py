@@ -6,13 +6,18 @@ Main entry point for the web interface
 import os
 import logging
 import base64
-from io import BytesIO
-from typing import Optional, Tuple, List
+import functools
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple, List
 import gradio as gr
-import pandas as pd
-from PIL import Image
 from dotenv import load_dotenv
-from app_agents.master_agent import MasterAgent
+from app_agents.runtime import iterate_async
+
+# pandas and the agents (openai, agents SDK, MCP) are imported on first use so
+# they stay off the cold-start path; see _warm_up()
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Load environment variables
 load_dotenv()
@@ -30,115 +35,316 @@ if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY not found in environment variables")
 
 
+# Maximum number of analyses running at the same time (each one calls the OpenAI API)
+ANALYZE_CONCURRENCY_LIMIT = 4
+
+# Uploads larger than this are rejected up front (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", "200000000"))
+
+# Above this many rows the agent is told to load only what it needs
+LARGE_FILE_ROWS = 1_000_000
+
+# Rows of a result dataframe shown in the UI table
+DISPLAY_ROWS = 1000
+
+
+AnalysisOutput = Tuple[str, Optional["pd.DataFrame"], Optional[List[str]]]
+
+
 def process_analysis(
     file: Optional[gr.File],
     query: str,
     api_key: Optional[str] = None
-) -> Tuple[str, Optional[pd.DataFrame], Optional[List[Image.Image]]]:
+) -> Iterator[AnalysisOutput]:
     """
     Process the user's file and query
     
+    Intermediate outputs are yielded while the agents work so the UI updates
+    progressively; the last yielded value is the complete result.
+    
     Args:
         file: Uploaded file object
         query: User's natural language query
         api_key: Optional API key override
         
-    Returns:
+    Yields:
         Tuple of (output_text, dataframe, images)
     """
     try:
         # Validate inputs
         if not file:
-            return "❌ Please upload an Excel (.xlsx) or CSV (.csv) file.", None, None
+            yield "❌ Please upload an Excel (.xlsx) or CSV (.csv) file.", None, None
+            return
         
         if not query or query.strip() == "":
-            return "❌ Please enter a query describing what you want to analyze.", None, None
+            yield "❌ Please enter a query describing what you want to analyze.", None, None
+            return
         
         # Get API key
         used_api_key = api_key if api_key else OPENAI_API_KEY
         # Log presence (masked) of API key from UI/env for diagnostics
         if api_key:
             masked = f"{api_key[:4]}...{api_key[-4:]}" if len(api_key) >= 8 else "***"
-            logger.info(f"API key provided via UI: True (masked: {masked})")
+            logger.info("API key provided via UI: True (masked: %s)", masked)
         else:
-            logger.info(f"API key provided via UI: False")
+            logger.info("API key provided via UI: False")
             if OPENAI_API_KEY:
                 masked_env = f"{OPENAI_API_KEY[:4]}...{OPENAI_API_KEY[-4:]}" if len(OPENAI_API_KEY) >= 8 else "***"
-                logger.info(f"Using OPENAI_API_KEY from env: True (masked: {masked_env})")
+                logger.info("Using OPENAI_API_KEY from env: True (masked: %s)", masked_env)
             else:
                 logger.info("Using OPENAI_API_KEY from env: False")
         if not used_api_key:
-            return "❌ Please provide an OpenAI API key either in the interface or as an environment variable (OPENAI_API_KEY).", None, None
+            yield "❌ Please provide an OpenAI API key either in the interface or as an environment variable (OPENAI_API_KEY).", None, None
+            return
         
         # Get file path
-        file_path = file.name
-        logger.info(f"Processing file: {file_path}")
-        logger.info(f"User query: {query}")
+        file_path = _file_path(file)
+        logger.info("Processing file: %s", file_path)
+        logger.info("User query: %s", query)
         
         # Validate file extension
         if not (file_path.endswith('.xlsx') or file_path.endswith('.csv')):
-            return "❌ Please upload a valid Excel (.xlsx) or CSV (.csv) file.", None, None
+            yield "❌ Please upload a valid Excel (.xlsx) or CSV (.csv) file.", None, None
+            return
+        
+        # Reject oversized files before any model call is spent on them
+        file_size = os.path.getsize(file_path)
+        if file_size > MAX_UPLOAD_BYTES:
+            yield (
+                f"❌ The file is too large ({file_size / 1e6:.0f} MB). "
+                f"The maximum size is {MAX_UPLOAD_BYTES / 1e6:.0f} MB."
+            ), None, None
+            return
+        
+        # Normally already computed by the upload handler
+        file_context = _file_context(file_path)
         
         # Initialize the master agent
         logger.info("Initializing Master Agent...")
+        from app_agents.master_agent import MasterAgent
         agent = MasterAgent(api_key=used_api_key, model="gpt-4o-mini")
         
-        # Analyze the file
+        # Analyze the file, streaming progress to the UI
         logger.info("Starting analysis...")
-        result = agent.analyze(user_query=query, file_path=file_path)
+        yield "⏳ **Analyzing...**", None, None
         
-        if not result['success']:
-            error_msg = result.get('error', 'Unknown error occurred')
-            return f"❌ Analysis failed:\n\n{error_msg}", None, None
+        result = None
+        streamed_text = []
+        for event in iterate_async(agent.analyze_stream(user_query=query, file_path=file_path, file_context=file_context)):
+            if event['type'] == 'token':
+                streamed_text.append(event['delta'])
+                yield "⏳ **Analyzing...**\n\n" + "".join(streamed_text), None, None
+            elif event['type'] == 'tool_start':
+                yield f"⏳ **Analyzing...** running `{event['tool']}`", None, None
+            elif event['type'] == 'final':
+                result = event
         
-        # Format output
-        output_parts = ["✅ **Analysis Complete**\n"]
+        yield _format_result(result)
         
-        # Add text output
-        if result['output']:
-            output_parts.append("### Results:\n")
-            output_parts.append(result['output'])
-            output_parts.append("\n")
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        yield f"❌ {error_msg}", None, None
+
+
+def _file_path(file: Any) -> str:
+    """Return the path of an upload (a str with type="filepath", a file object otherwise)"""
+    return file if isinstance(file, str) else file.name
+
+
+@functools.lru_cache(maxsize=32)
+def _file_context(file_path: str) -> Optional[str]:
+    """
+    Describe an uploaded file (sheets, size, columns, dtypes, first rows) for the agent's prompt
+    
+    Knowing the schema up front lets the agent write the analysis in its first
+    tool call instead of spending a round trip on df.head() / df.columns.
+    Cached per path: uploads get a fresh temporary path each time.
+    
+    Args:
+        file_path: Path to the uploaded file
         
-        # Add code if available
-        if result['code']:
-            output_parts.append("\n### Generated Code:\n")
-            output_parts.append("```python\n")
-            output_parts.append(result['code'])
-            output_parts.append("\n```\n")
+    Returns:
+        Prompt-ready description, or None if the file could not be read
+    """
+    contexts = (_workbook_context(file_path), _size_note(file_path), _schema_preview(file_path))
+    parts = [context for context in contexts if context]
+    return "\n\n".join(parts) or None
+
+
+def _count_rows(file_path: str) -> Optional[int]:
+    """
+    Count data rows without parsing the file
+    
+    CSV: newlines counted over raw 1 MB chunks. xlsx: the first sheet's dimension
+    as recorded in the workbook (read-only mode, cells are not loaded).
+    
+    Returns:
+        Approximate number of data rows, or None if unknown
+    """
+    try:
+        if file_path.endswith('.csv'):
+            with open(file_path, 'rb') as f:
+                newlines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+            return max(newlines - 1, 0)
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+        return max(max_row - 1, 0) if max_row else None
+    except Exception as e:
+        logger.debug("Could not count rows: %s", e)
+        return None
+
+
+def _size_note(file_path: str) -> Optional[str]:
+    """Warn the agent about very large files so it does not load everything blindly"""
+    rows = _count_rows(file_path)
+    if rows is None or rows <= LARGE_FILE_ROWS:
+        return None
+    return (
+        f"NOTE: the file has about {rows:,} rows. Load only the columns you need (usecols=...), "
+        f"use vectorized aggregations, and plot a sample (df.sample(100_000)) rather than every row."
+    )
+
+
+def _schema_preview(file_path: str, nrows: int = 50) -> Optional[str]:
+    """
+    Read the first rows of a file and summarize its columns
+    
+    Args:
+        file_path: Path to an .xlsx or .csv file
+        nrows: Number of rows read to infer dtypes (default: 50)
+        
+    Returns:
+        Columns with dtypes followed by the first 5 rows, or None on error
+    """
+    import pandas as pd
+    try:
+        if file_path.endswith('.csv'):
+            df = pd.read_csv(file_path, nrows=nrows)
+        else:
+            df = pd.read_excel(file_path, nrows=nrows)
+    except Exception as e:
+        logger.warning("Could not read schema preview: %s", e)
+        return None
+    columns = "\n".join(f"- {col}: {dtype}" for col, dtype in df.dtypes.items())
+    head = df.head(5).to_string(max_cols=20, max_colwidth=40)
+    return f"Columns (dtypes inferred from the first {nrows} rows):\n{columns}\n\nFirst rows:\n{head}"
+
+
+def _on_upload(file: Any) -> None:
+    """Compute the file context as soon as a file is uploaded, while the user types the query"""
+    if file:
+        _file_context(_file_path(file))
+
+
+def _workbook_context(file_path: str) -> Optional[str]:
+    """
+    List the sheets of an Excel workbook for the agent's prompt
+    
+    Args:
+        file_path: Path to the uploaded file
         
-        output_text = "\n".join(output_parts)
+    Returns:
+        One-line description of the sheets, or None for CSV files or when
+        python-calamine is not installed
+    """
+    if not file_path.endswith('.xlsx'):
+        return None
+    try:
+        from python_calamine import CalamineWorkbook
+        sheet_names = CalamineWorkbook.from_path(file_path).sheet_names
+    except Exception as e:
+        logger.debug("Could not read sheet names: %s", e)
+        return None
+    return f"Workbook sheets: {', '.join(sheet_names)} (pd.read_excel reads the first one unless sheet_name is given)"
+
+
+def _format_result(result: Dict[str, Any]) -> AnalysisOutput:
+    """
+    Convert a MasterAgent result into the interface outputs
+    
+    Args:
+        result: Dictionary returned by MasterAgent.analyze (or its final stream event)
         
-        # Prepare dataframe
-        df_output = None
-        if result['dataframe']:
-            try:
+    Returns:
+        Tuple of (output_text, dataframe, images)
+    """
+    import pandas as pd
+    
+    if not result['success']:
+        error_msg = result.get('error', 'Unknown error occurred')
+        return f"❌ Analysis failed:\n\n{error_msg}", None, None
+    
+    # Format output (sections and notes are joined once at the end)
+    output_parts = ["✅ **Analysis Complete**\n"]
+    
+    # Add text output
+    if result['output']:
+        output_parts.append(f"### Results:\n\n{result['output']}\n")
+    
+    # Add the tables of a multi-table result
+    for name, records in (result.get('tables') or {}).items():
+        output_parts.append(f"\n### {name}\n\n```\n{pd.DataFrame(records).to_string()}\n```\n")
+    
+    # Add code if available
+    if result['code']:
+        output_parts.append(f"\n### Generated Code:\n\n```python\n\n{result['code']}\n\n```\n")
+    
+    # Prepare dataframe
+    df_output = None
+    if result.get('dataframe_path') or result['dataframe']:
+        try:
+            if result.get('dataframe_path') and os.path.isfile(result['dataframe_path']):
+                # Columnar load of the (capped) result written by the sandbox
+                df_output = pd.read_feather(result['dataframe_path']).head(DISPLAY_ROWS)
+            else:
                 df_output = pd.DataFrame(result['dataframe'])
-                logger.info(f"Dataframe prepared: {len(df_output)} rows")
-            except Exception as e:
-                logger.error(f"Error preparing dataframe: {e}")
-                output_text += f"\n\n⚠️ Note: Could not display dataframe - {str(e)}"
-        
-        # Prepare images
-        images_output = None
-        if result['images']:
-            try:
-                images_output = []
-                for img_base64 in result['images']:
-                    img_data = base64.b64decode(img_base64)
-                    img = Image.open(BytesIO(img_data))
-                    images_output.append(img)
-                logger.info(f"Prepared {len(images_output)} images")
-            except Exception as e:
-                logger.error(f"Error preparing images: {e}")
-                output_text += f"\n\n⚠️ Note: Could not display images - {str(e)}"
+            logger.info("Dataframe prepared: %s rows", len(df_output))
+        except Exception as e:
+            logger.error("Error preparing dataframe: %s", e)
+            output_parts.append(f"\n⚠️ Note: Could not display dataframe - {str(e)}")
+    
+    # Prepare images
+    images_output = None
+    if result['images']:
+        try:
+            images_output = [_image_path(image) for image in result['images']]
+            logger.info("Prepared %s images", len(images_output))
+        except Exception as e:
+            logger.error("Error preparing images: %s", e)
+            output_parts.append(f"\n⚠️ Note: Could not display images - {str(e)}")
+    
+    output_text = "\n".join(output_parts)
+    
+    return output_text, df_output, images_output
+
+
+def _image_path(image: str) -> str:
+    """
+    Return a file path gr.Gallery can serve for a tool image
+    
+    Args:
+        image: PNG file path written by the sandbox, or a base64 encoded PNG
         
-        return output_text, df_output, images_output
+    Returns:
+        Path to the PNG file
         
-    except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        logger.error(error_msg, exc_info=True)
-        return f"❌ {error_msg}", None, None
+    Raises:
+        FileNotFoundError: If image is a path to a file that no longer exists
+    """
+    if os.path.isfile(image):
+        return image
+    if os.path.isabs(image):
+        # A file path whose file was cleaned up, not a base64 payload
+        raise FileNotFoundError(f"Image no longer available: {image}")
+    # Older base64 payloads: write the raw bytes out, no PIL decode needed
+    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+        f.write(base64.b64decode(image))
+    return f.name
 
 
 def create_interface() -> gr.Blocks:
@@ -241,23 +447,57 @@ def create_interface() -> gr.Blocks:
             """
         )
         
+        # Parse the file once on upload; the analysis reuses the cached summary
+        file_input.upload(fn=_on_upload, inputs=file_input, outputs=None, queue=False)
+        
         # Connect the submit button
         submit_btn.click(
             fn=process_analysis,
             inputs=[file_input, query_input, api_key_input],
-            outputs=[output_text, output_dataframe, output_images]
+            outputs=[output_text, output_dataframe, output_images],
+            api_name="analyze",
+            queue=True,
+            # Shared with the Enter-key handler: at most 4 analyses hit OpenAI at once,
+            # which keeps bursts below the rate limits instead of triggering retry storms
+            concurrency_limit=ANALYZE_CONCURRENCY_LIMIT,
+            concurrency_id="analyze"
         )
         
         # Also allow Enter key to submit
         query_input.submit(
             fn=process_analysis,
             inputs=[file_input, query_input, api_key_input],
-            outputs=[output_text, output_dataframe, output_images]
+            outputs=[output_text, output_dataframe, output_images],
+            queue=True,
+            concurrency_limit=ANALYZE_CONCURRENCY_LIMIT,
+            concurrency_id="analyze"
         )
     
+    # Bounded queue: concurrent users wait their turn instead of piling up requests
+    interface.queue(default_concurrency_limit=8, max_size=64)
+    
     return interface
 
 
+def _warm_up() -> None:
+    """
+    Import the agent stack and connect the MCP servers in the background
+    
+    The UI comes up without waiting for these imports, and the first analysis
+    finds everything loaded instead of paying for it.
+    """
+    try:
+        import pandas  # noqa: F401
+        from app_agents.mcp_client import get_server
+        from app_agents.runtime import run_coroutine
+        import app_agents.master_agent  # noqa: F401
+        for key in ("python", "web"):
+            run_coroutine(get_server(key))
+        logger.info("Agents warmed up")
+    except Exception as e:
+        logger.warning("Warm-up failed, components load on first request: %s", e)
+
+
 def main():
     """
     Main entry point
@@ -267,6 +507,8 @@ def main():
     # Create and launch the interface
     interface = create_interface()
     
+    threading.Thread(target=_warm_up, name="app-warmup", daemon=True).start()
+    
     interface.launch(
         server_name="0.0.0.0",
         server_port=7860,
@@ -2,103 +2,112 @@
 Excel Analysis Agent - MCP client using Agents SDK
 """
 
+import contextvars
 import logging
+import re
+from typing import Any, List, Optional, Union
 
-from agents import Agent
-from agents.mcp import MCPServerStdio, create_static_tool_filter
+from agents import Agent, AgentHooks, FunctionToolResult, Model, RunContextWrapper, ToolsToFinalOutputResult
+from agents.mcp import MCPServer, create_static_tool_filter
 from agents.model_settings import ModelSettings
 
+from . import json_utils
+from .mcp_client import CODE_TOOL_NAMES
+from .prompts import EXCEL_ANALYSIS_INSTRUCTIONS
+
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-EXCEL_ANALYSIS_INSTRUCTIONS = """You are an expert Excel Data Analyst Agent specialized in analyzing and visualizing data from Excel and CSV files.
-
-IMPORTANT: You MUST use the MCP tool execute_python_code(code, file_path) to run Python code. Do NOT just explain the code — EXECUTE it via the tool.
-
-Your capabilities:
-1. Read and analyze Excel (.xlsx) and CSV files using pandas
-2. Perform data manipulation, aggregation, and statistical analysis
-3. Create visualizations using matplotlib and seaborn
-4. Generate clear, actionable insights from data
-5. Write clean, efficient Python code
-
-Available Actions:
-- execute_python_code(code, file_path): Execute Python for data analysis. The file path is provided in user messages.
-
-Guidelines:
-- YOU MUST CALL execute_python_code — never just describe code
-- Always read the file first using: pd.read_excel(file_path) or pd.read_csv(file_path)
-- Store the main dataframe in a variable named 'df' (or 'result')
-- CRITICAL: Always use print() to display results and data to the user
-- For dataframes: use print(df.head(10)) or print(df)
-- For statistics: use print(df.describe()) or print(<metric>)
-- Create clear, well-labeled visualizations; do not call plt.show() (figures are captured automatically)
-
-IMPORTANT OUTPUT FORMATTING:
-After calling execute_python_code, the tool returns a result with structure: {'success': bool, 'output': str, 'error': str, 'dataframe': list, 'images': list}
-- Your final response MUST be the complete JSON object returned by the execute_python_code tool
-- Return it exactly as received, including all fields: 'success', 'output', 'error', 'dataframe', and 'images'
-- This allows the orchestrator to properly extract dataframe and images from your response
-
-
-Code Examples:
-
-Example 1: Show first N rows
-```python
-import pandas as pd
-
-df = pd.read_excel(file_path)
-print("First 10 rows:")
-print(df.head(10))
-```
-
-Example 2: Calculate statistics (average of a column)
-```python
-import pandas as pd
-
-df = pd.read_excel(file_path)
-average_sales = df['Sales'].mean()
-print(f"Average Sales: {average_sales:.2f}")
-
-avg_by_category = df.groupby('Category')['Sales'].mean()
-print("\nAverage Sales by Category:")
-print(avg_by_category)
-```
-
-Example 3: Create a visualization
-```python
-import pandas as pd
-import matplotlib.pyplot as plt
-
-df = pd.read_excel(file_path)
-country_counts = df['Country'].value_counts()
-plt.figure(figsize=(10, 8))
-plt.pie(country_counts, labels=country_counts.index, autopct='%1.1f%%', startangle=90)
-plt.title('Distribution by Country')
-plt.axis('equal')
-# Do not call plt.show()
-```
-
-Example 4: Calculate median of a column
-```python
-import pandas as pd
-
-df = pd.read_excel(file_path)
-median_price = df['Sale Price'].median()
-print(f"Median Sale Price: {median_price:.2f}")
-```
-"""
+# Turn budget for an Excel agent run (a tool call per turn; a success ends the run)
+EXCEL_MAX_TURNS = 4
+
+# Consecutive failures with the same error after which the Excel agent stops retrying
+REPEATED_FAILURE_LIMIT = 2
+
+# execute_python_code results of the current analysis, in call order. Set per run
+# by the caller; unset means results are not collected.
+_tool_results: contextvars.ContextVar[Optional[List[json_utils.ToolResult]]] = contextvars.ContextVar(
+    "excel_tool_results", default=None
+)
+
+
+def start_result_collection() -> List[json_utils.ToolResult]:
+    """
+    Start collecting execute_python_code results for the current analysis run
+    
+    Returns:
+        List that receives each decoded result as the tool returns
+    """
+    results: List[json_utils.ToolResult] = []
+    _tool_results.set(results)
+    return results
+
+
+class ToolResultCollector(AgentHooks):
+    """
+    Decodes each execute_python_code / batch result once, as the tool returns, so callers
+    do not have to scan and re-parse the run items afterwards
+    """
+
+    async def on_tool_end(self, context: RunContextWrapper, agent: Agent, tool: Any, result: str) -> None:
+        results = _tool_results.get()
+        if results is None or getattr(tool, "name", None) not in CODE_TOOL_NAMES:
+            return
+        tool_result = json_utils.decode_tool_result(result)
+        if tool_result is not None:
+            results.append(tool_result)
+
+
+def _error_signature(error: Optional[str]) -> str:
+    """First line of an error with numbers blanked, so reruns of the same mistake compare equal"""
+    first_line = (error or "").strip().split("\n", 1)[0]
+    return re.sub(r"\d+", "#", first_line)
 
 
-def create_excel_agent(mcp_server: MCPServerStdio, model: str = "gpt-4o-mini") -> Agent:
+def _repeated_failure() -> bool:
+    """True if the last REPEATED_FAILURE_LIMIT collected results failed with the same error"""
+    results = _tool_results.get()
+    if not results or len(results) < REPEATED_FAILURE_LIMIT:
+        return False
+    last = results[-REPEATED_FAILURE_LIMIT:]
+    if any(result.success for result in last):
+        return False
+    return len({_error_signature(result.error) for result in last}) == 1
+
+
+def _stop_on_success(context: RunContextWrapper, tool_results: List[FunctionToolResult]) -> ToolsToFinalOutputResult:
+    """
+    End the run as soon as execute_python_code succeeds, returning its result as-is
+    
+    The model would otherwise spend a whole turn re-generating the tool's JSON
+    (dataframe preview included) token by token. Failed calls go back to the model
+    so it can fix the code and retry, unless the same error came back
+    REPEATED_FAILURE_LIMIT times in a row: the run then ends with that failure, so
+    the caller can look for help instead of paying for more identical attempts.
+    """
+    for tool_result in reversed(tool_results):
+        if isinstance(tool_result.output, str):
+            output = json_utils.unwrap_tool_output(tool_result.output)
+            decoded = json_utils.decode_tool_result(output)
+            if decoded is not None and decoded.success:
+                return ToolsToFinalOutputResult(is_final_output=True, final_output=output)
+    if _repeated_failure():
+        logger.info("Same error %s times in a row, ending the Excel run", REPEATED_FAILURE_LIMIT)
+        output = tool_results[-1].output if tool_results else None
+        if isinstance(output, str):
+            output = json_utils.unwrap_tool_output(output)
+        return ToolsToFinalOutputResult(is_final_output=True, final_output=output)
+    return ToolsToFinalOutputResult(is_final_output=False, final_output=None)
+
+
+def create_excel_agent(mcp_server: MCPServer, model: Union[str, Model] = "gpt-4o-mini") -> Agent:
     """
     Create an Agent SDK for Excel analysis
     
     Args:
-        mcp_server: MCP server already configured with execute_python_code tool filter
-        model: OpenAI model to use
+        mcp_server: MCP server (or pooled view) exposing only the code execution tools
+        model: OpenAI model name, or a Model bound to a shared client
     
     Returns:
         Agent configured for Excel analysis
@@ -107,7 +116,19 @@ def create_excel_agent(mcp_server: MCPServerStdio, model: str = "gpt-4o-mini") -
         name="ExcelAnalysisAgent",
         instructions=EXCEL_ANALYSIS_INSTRUCTIONS,
         mcp_servers=[mcp_server],
+        # Strict schemas let the API constrain tool-call generation to the schema
+        mcp_config={"convert_schemas_to_strict": True},
         model=model,
+        # Capped, low-temperature completions (the agent only has to emit one script)
+        # and a stable key so OpenAI routes requests sharing the long static
+        # instructions to the same prompt cache
+        model_settings=ModelSettings(
+            max_tokens=1024,
+            temperature=0.2,
+            extra_body={"prompt_cache_key": "excel-analysis-agent-v2"},
+        ),
+        tool_use_behavior=_stop_on_success,
+        hooks=ToolResultCollector(),
     )
 
 
@@ -0,0 +1,100 @@
+"""
+Fast path for simple queries
+Maps common requests to canned pandas code so they run without any LLM call
+"""
+
+import re
+from typing import Callable, List, Optional, Tuple
+
+
+# Every snippet starts by loading the uploaded file into df
+READ_FILE_CODE = (
+    "import pandas as pd\n"
+    "df = pd.read_csv(file_path) if file_path.lower().endswith('.csv') else pd.read_excel(file_path)\n"
+)
+
+# Column name, optionally quoted and optionally introduced/followed by the word "column".
+# Connector words are excluded so compound requests ("... per region and a chart") fall through
+_COL = (
+    r"(?:the\s+)?(?:column\s+)?[\"'`]?"
+    r"(?P<col>\w(?:(?!\s(?:and|per|by|for|with|grouped|vs|in)\b)[\w .-])*?)"
+    r"[\"'`]?(?:\s+column)?"
+)
+
+_AGGREGATIONS = {
+    "average": "mean", "mean": "mean", "median": "median",
+    "sum": "sum", "total": "sum",
+    "min": "min", "minimum": "min", "max": "max", "maximum": "max",
+}
+
+
+def _first_rows(match: re.Match) -> str:
+    n = int(match.group("n"))
+    return READ_FILE_CODE + f"df = df.head({n})\nprint('First {n} rows:')\nprint(df)\n"
+
+
+def _describe(match: re.Match) -> str:
+    return READ_FILE_CODE + "df = df.describe()\nprint('Summary statistics:')\nprint(df)\n"
+
+
+def _aggregate(match: re.Match) -> str:
+    col = match.group("col")
+    func = _AGGREGATIONS[match.group("agg").lower()]
+    return READ_FILE_CODE + (
+        f"value = df[{col!r}].{func}()\n"
+        f"print(f\"{match.group('agg').capitalize()} of {col}: {{value}}\")\n"
+    )
+
+
+def _top_n(match: re.Match) -> str:
+    n = int(match.group("n"))
+    col = match.group("col")
+    return READ_FILE_CODE + f"df = df.nlargest({n}, {col!r})\nprint('Top {n} rows by {col}:')\nprint(df)\n"
+
+
+def _histogram(match: re.Match) -> str:
+    col = match.group("col")
+    return READ_FILE_CODE + (
+        "import matplotlib.pyplot as plt\n"
+        "plt.figure(figsize=(10, 6))\n"
+        f"plt.hist(df[{col!r}].dropna(), bins=20, edgecolor='black')\n"
+        f"plt.title('Distribution of {col}')\n"
+        f"plt.xlabel({col!r})\n"
+        "plt.ylabel('Count')\n"
+        f"print(df[{col!r}].describe())\n"
+    )
+
+
+# (pattern, snippet builder); a query must match a pattern in full
+_FAST_PATHS: List[Tuple[re.Pattern, Callable[[re.Match], str]]] = [
+    (re.compile(r"(?:show|display|print|give|get)?\s*(?:me\s+)?(?:the\s+)?first\s+(?P<n>\d{1,4})\s+rows?", re.I),
+     _first_rows),
+    (re.compile(r"(?:show|give|get)?\s*(?:me\s+)?(?:the\s+)?(?:summary|descriptive)\s+statistics|describe(?:\s+the\s+data)?", re.I),
+     _describe),
+    (re.compile(r"(?:what\s+is\s+|calculate\s+|compute\s+|show\s+)?(?:the\s+)?(?P<agg>" + "|".join(_AGGREGATIONS) +
+                r")\s+(?:of\s+)?" + _COL, re.I),
+     _aggregate),
+    (re.compile(r"(?:show\s+)?(?:me\s+)?(?:the\s+)?top\s+(?P<n>\d{1,4})\s+(?:rows\s+)?by\s+" + _COL, re.I),
+     _top_n),
+    (re.compile(r"(?:create|plot|draw|make|show)?\s*(?:me\s+)?(?:an?\s+)?histogram\s+(?:of|for)\s+" + _COL, re.I),
+     _histogram),
+]
+
+
+def match_query(user_query: str) -> Optional[str]:
+    """
+    Return canned code for a simple query
+
+    Args:
+        user_query: User's natural language query
+
+    Returns:
+        Python code for execute_python_code (file_path is provided by the sandbox),
+        or None when the query needs the agents
+    """
+    query = user_query.strip().rstrip(".?!").strip()
+    for pattern, build in _FAST_PATHS:
+        match = pattern.fullmatch(query)
+        if match:
+            return build(match)
+    return None
@@ -0,0 +1,161 @@
+"""
+JSON helpers for tool payloads
+Uses orjson when installed and falls back to the standard library json module
+"""
+
+import re
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+    import json
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - msgspec is optional
+    msgspec = None
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """
+    Parse a JSON document
+    
+    Args:
+        data: JSON text (str or UTF-8 bytes)
+        
+    Returns:
+        Parsed Python object
+        
+    Raises:
+        ValueError: If data is not valid JSON (json.JSONDecodeError and
+            orjson.JSONDecodeError are both ValueError subclasses)
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """
+    Serialize an object to a JSON string (non-ASCII characters are kept as-is)
+    
+    Args:
+        obj: Object to serialize; non-string dict keys and numpy values are supported
+        sort_keys: Sort dict keys, for a canonical encoding (default: False)
+        
+    Returns:
+        JSON text
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys)
+
+
+# Typed view of the execute_python_code result; unknown keys are ignored
+if msgspec is not None:
+    class ToolResult(msgspec.Struct, frozen=True):
+        success: bool
+        output: Optional[str] = None
+        error: Optional[str] = None
+        dataframe: Optional[List[Dict[str, Any]]] = None
+        dataframe_path: Optional[str] = None
+        tables: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        images: Optional[List[str]] = None
+
+    _TOOL_RESULT_DECODER = msgspec.json.Decoder(ToolResult)
+else:  # pragma: no cover - plain dataclass when msgspec is not installed
+    @dataclass(frozen=True)
+    class ToolResult:
+        success: bool
+        output: Optional[str] = None
+        error: Optional[str] = None
+        dataframe: Optional[List[Dict[str, Any]]] = None
+        dataframe_path: Optional[str] = None
+        tables: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        images: Optional[List[str]] = None
+
+    _TOOL_RESULT_FIELDS = frozenset(f.name for f in fields(ToolResult))
+
+
+# FastMCP reports a str return value as {"result": "<text>"} structured content, and
+# the SDK hands single text contents over as {"type": "text", "text": "<text>"}
+_RESULT_WRAPPER = re.compile(r'\s*\{\s*"(?:result|type)"\s*:')
+
+
+def unwrap_tool_output(data: str) -> str:
+    """
+    Strip the {"result": ...} structured-content wrapper, or the {"type": "text", ...}
+    text-content wrapper, from a tool output
+    
+    Args:
+        data: Tool output as seen by the agent
+        
+    Returns:
+        The wrapped text, or data unchanged when it is not wrapped (checked with a
+        prefix match, so unwrapped outputs are not parsed)
+    """
+    if not _RESULT_WRAPPER.match(data):
+        return data
+    try:
+        obj = loads(data)
+    except ValueError:
+        return data
+    if isinstance(obj, dict):
+        if len(obj) == 1 and isinstance(obj.get("result"), str):
+            return obj["result"]
+        if obj.get("type") == "text" and isinstance(obj.get("text"), str):
+            return obj["text"]
+    return data
+
+
+def decode_tool_result(data: Union[str, bytes]) -> Optional[ToolResult]:
+    """
+    Decode an execute_python_code result in a single typed pass
+    
+    Args:
+        data: JSON text returned by the tool, optionally inside the structured-content wrapper
+        
+    Returns:
+        ToolResult, or None if data is not a JSON tool result
+    """
+    if isinstance(data, str):
+        data = unwrap_tool_output(data)
+    if msgspec is not None:
+        try:
+            return _TOOL_RESULT_DECODER.decode(data)
+        except msgspec.DecodeError:
+            return None
+    try:
+        obj = loads(data)
+    except ValueError:
+        return None
+    return tool_result_from_dict(obj)
+
+
+def tool_result_from_dict(obj: Any) -> Optional[ToolResult]:
+    """
+    Convert an already-parsed execute_python_code result (structured content)
+    
+    Args:
+        obj: Result dict as returned by the tool
+        
+    Returns:
+        ToolResult, or None if obj is not a tool result
+    """
+    if not isinstance(obj, dict) or not isinstance(obj.get("success"), bool):
+        return None
+    if msgspec is not None:
+        try:
+            return msgspec.convert(obj, ToolResult)
+        except msgspec.ValidationError:
+            return None
+    try:
+        return ToolResult(**{k: v for k, v in obj.items() if k in _TOOL_RESULT_FIELDS})
+    except TypeError:
+        return None
@@ -2,39 +2,94 @@
 Master Agent - coordinates ExcelAnalysisAgent and WebSearchAgent as tools
 """
 
+import asyncio
+import concurrent.futures
+import hashlib
 import logging
 import os
-import asyncio
-import json
-from typing import Dict, Any, Optional
+import re
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 
-from agents import Agent, Runner
-from agents.mcp import MCPServerStdio, create_static_tool_filter
+from agents import Agent, OpenAIResponsesModel, Runner, ToolCallOutputItem, set_tracing_export_api_key
+from agents.mcp import MCPServer
+from agents.model_settings import ModelSettings
+from agents.result import RunResultBase
+from openai.types.responses import ResponseTextDeltaEvent
 
-from .excel_agent import create_excel_agent
+from . import fast_path, json_utils
+from .prompts import MASTER_AGENT_PROMPT
+from .mcp_client import get_server, start_call_tracking
+from .runtime import get_openai_client, run_coroutine
+from .excel_agent import EXCEL_MAX_TURNS, create_excel_agent, start_result_collection
 from .web_agent import create_web_search_agent
 
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-MASTER_AGENT_PROMPT = """
-You are the orchestrator of a multi-agent system. Your task is to take the user's query and the file path and pass it to the appropriate agent tool.
+# Static per-process configuration, built once instead of on every analyze() call
+EXCEL_TOOL_DESCRIPTION = "Execute Python code to analyze Excel/CSV files and create visualizations. The agent receives the user query and file path and must execute the exact analysis requested."
+WEB_TOOL_DESCRIPTION = "Search the web for up-to-date information, documentation, and code examples"
 
-Available agent tools:
-- excel_analysis_agent: Executes Python code for data analysis and visualization using pandas and matplotlib. 
-  When calling this tool, you MUST pass the complete user query and the file path so it can execute the correct analysis.
-- web_search_agent: Searches the web for documentation, examples, and solutions.
+# Queries that look like they need documentation or are about an error: with
+# speculative_web the web search is started alongside the Excel run for these
+WEB_HINT_PATTERN = re.compile(
+    r"how (?:do i|to|can i)|using (?:pandas|numpy|matplotlib|seaborn)|"
+    r"traceback|error|exception|documentation|\bdocs?\b|example",
+    re.IGNORECASE,
+)
 
-Your strategy:
-1. First, try to use the excel_analysis_agent to directly answer the user's query using the file path.
-   IMPORTANT: When calling excel_analysis_agent, include the FULL user query in your message to the tool.
-2. If the analysis fails or needs additional context, use the web_search_agent to find relevant information.
-3. Use the web search results to guide a retry with the excel_analysis_agent.
+# JSON tool result echoed inside a markdown code block
+JSON_FENCE_PATTERN = re.compile(r"```json\s*(.*?)```", re.DOTALL)
 
-Always provide clear, actionable results to the user.
-"""
+# Upper bound (seconds) for a synchronous analyze() call, agent retries included
+ANALYSIS_TIMEOUT = 300
+
+# Successful results of recent analyses, keyed by (file sha256, query, model) so
+# re-running the same question on the same file skips the whole agent chain
+RESULT_CACHE_SIZE = 64
+_result_cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+
+def _file_digest(file_path: str) -> str:
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Agents built by MasterAgent._get_agents, keyed by (api key sha256, model, python
+# server, web server), least recently used first
+AGENT_CACHE_SIZE = 8
+_agents: "OrderedDict[Tuple[str, str, MCPServer, MCPServer], Tuple[Agent, Agent, Agent]]" = OrderedDict()
+_agents_lock = threading.Lock()
+
+
+def _result_cache_get(key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+    with _result_cache_lock:
+        cached = _result_cache.get(key)
+        if cached is None:
+            return None
+        # Figures and dataframes are returned by path; expired output files invalidate the entry
+        paths = list(cached.get("images") or []) + [cached.get("dataframe_path")]
+        if not all(os.path.exists(path) for path in paths if path and os.path.isabs(path)):
+            del _result_cache[key]
+            return None
+        _result_cache.move_to_end(key)
+        return dict(cached)
+
+
+def _result_cache_put(key: Tuple[str, str, str], value: Dict[str, Any]) -> None:
+    with _result_cache_lock:
+        _result_cache[key] = dict(value)
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
 
 
 class MasterAgent:
@@ -42,132 +97,176 @@ class MasterAgent:
     Master agent that coordinates ExcelAnalysisAgent and WebSearchAgent as tools.
     """
 
-    def __init__(self, api_key: str, model: str = "gpt-4o-mini"):
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini", speculative_web: bool = False,
+                 cache_results: bool = True, use_fast_path: bool = True, excel_first: bool = True):
+        """
+        Args:
+            api_key: OpenAI API key
+            model: OpenAI model name used by every agent
+            speculative_web: For queries matching WEB_HINT_PATTERN, run the Excel agent and
+                the web search concurrently; the search is cancelled if the Excel run succeeds
+            cache_results: Reuse the result of an identical earlier query on the same file
+            use_fast_path: Run simple queries ("first 10 rows", "average of Sales", ...) as
+                canned code without calling the model; see fast_path.match_query
+            excel_first: Run the Excel agent directly first and only involve the orchestrator
+                (and web search) if it fails, saving the orchestrator's routing turn
+        """
         if api_key:
-            os.environ["OPENAI_API_KEY"] = api_key
+            # Only the trace exporter needs the key globally; the models get their own
+            # client, and the key stays out of os.environ (and of the tool processes)
+            set_tracing_export_api_key(api_key)
+        self.api_key = api_key
         self.model = model
+        self.speculative_web = speculative_web
+        self.cache_results = cache_results
+        self.use_fast_path = use_fast_path
+        self.excel_first = excel_first
 
-    def analyze(self, user_query: str, file_path: str) -> Dict[str, Any]:
+    def analyze(self, user_query: str, file_path: str, file_context: Optional[str] = None) -> Dict[str, Any]:
         """
         Coordinate the two agents to get the best possible result
+        
+        Thin synchronous adapter over analyze_stream() that only keeps the final result.
         """
         async def _arun():
-            # Create MCP servers
-            python_server = MCPServerStdio(
-                name="excel-tools-python",
-                params={"command": "python", "args": ["-m", "app_agents.mcp_server"]},
-                cache_tools_list=True,
-                use_structured_content=True,
-                tool_filter=create_static_tool_filter(allowed_tool_names=["execute_python_code"]),
-            )
-            
-            web_server = MCPServerStdio(
-                name="excel-tools-web",
-                params={"command": "python", "args": ["-m", "app_agents.mcp_server"]},
-                cache_tools_list=True,
-                tool_filter=create_static_tool_filter(allowed_tool_names=["search_web"]),
-            )
-            
-            # Connect servers
-            await python_server.connect()
-            await web_server.connect()
+            final = None
+            async for event in self.analyze_stream(user_query, file_path, file_context):
+                if event['type'] == 'final':
+                    final = event
+            return final
+
+        # Run on the shared background loop so pooled connections are reused
+        try:
+            final = run_coroutine(_arun(), timeout=ANALYSIS_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            err = f"MasterAgent error: analysis timed out after {ANALYSIS_TIMEOUT} seconds"
+            logger.error(err)
+            return {"success": False, "output": None, "dataframe": None, "images": [], "code": None, "error": err}
+        return {key: value for key, value in final.items() if key != 'type'}
+
+    async def analyze_stream(self, user_query: str, file_path: str,
+                             file_context: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run the analysis and yield progress events as they happen
+        
+        Args:
+            user_query: User's natural language query
+            file_path: Path to the uploaded Excel/CSV file
+            file_context: Known facts about the file (e.g. its sheet names), passed on
+                to the Excel agent so it can skip an exploratory call
             
+        Yields:
+            Event dictionaries with a 'type' key:
+                - token: {'delta': str} text generated by the orchestrator
+                - tool_start: {'tool': str} an agent tool was called
+                - tool_output: {'output': str} an agent tool returned
+                - final: the analyze() result keys (success, output, dataframe, images, code, error)
+        """
+        cache_key = None
+        if self.cache_results:
             try:
-                # Create specialized agents using functions from their respective modules
-                excel_agent = create_excel_agent(mcp_server=python_server, model=self.model)
-                web_agent = create_web_search_agent(mcp_server=web_server, model=self.model)
-                
-                # Create orchestrator agent with other agents as tools
-                orchestrator = Agent(
-                    name="MasterAgent",
-                    model=self.model,
-                    instructions=MASTER_AGENT_PROMPT,
-                    tools=[
-                        excel_agent.as_tool(
-                            tool_name="excel_analysis_agent",
-                            tool_description="Execute Python code to analyze Excel/CSV files and create visualizations. The agent receives the user query and file path and must execute the exact analysis requested."
-                        ),
-                        web_agent.as_tool(
-                            tool_name="web_search_agent",
-                            tool_description="Search the web for up-to-date information, documentation, and code examples"
-                        ),
-                    ],
-                )
-                
-                # Prepare user message with file path
-                user_msg = (
-                    f"User query: {user_query}\n"
-                    f"File path: {file_path}\n\n"
-                    f"Call the excel_analysis_agent tool with this exact message:\n"
-                    f"'Analyze this request: {user_query}\\n\\nThe file is located at: {file_path}\\n\\n"
-                    f"Write Python code and call execute_python_code with that code and the same file_path.'\n\n"
-                    f"Make sure to pass the complete user query to the excel_analysis_agent so it can perform the correct analysis."
+                digest = await asyncio.to_thread(_file_digest, file_path)
+                cache_key = (digest, user_query.strip(), self.model)
+            except OSError as e:
+                logger.warning("Could not hash %s, result cache skipped: %s", file_path, e)
+            cached = _result_cache_get(cache_key) if cache_key else None
+            if cached is not None:
+                logger.info("Result cache hit for query: %s", user_query)
+                yield {'type': 'final', **cached}
+                return
+        
+        async for event in self._run_stream(user_query, file_path, file_context):
+            if event['type'] == 'final':
+                # Shapes only: the payload (records, image paths, output text) can be large
+                logger.info(
+                    "Analysis finished: success=%s, %s preview rows, %s tables, %s images",
+                    event['success'], len(event.get('dataframe') or ()),
+                    len(event.get('tables') or ()), len(event.get('images') or ()),
                 )
-                
-                # Run orchestrator
-                result = await Runner.run(orchestrator, user_msg, max_turns=20)
-                
-                return result
-            finally:
-                # Clean up servers
-                for server in [python_server, web_server]:
-                    close_fn = getattr(server, "close", None) or getattr(server, "aclose", None)
-                    if close_fn:
-                        res = close_fn()
-                        if hasattr(res, "__await__"):
-                            await res
+                if event['success'] and cache_key:
+                    _result_cache_put(cache_key, {key: value for key, value in event.items() if key != 'type'})
+            yield event
 
+    async def _run_stream(self, user_query: str, file_path: str,
+                          file_context: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+        """Run the agent chain for analyze_stream(), without the result cache"""
         try:
-            loop = asyncio.new_event_loop()
-            try:
-                asyncio.set_event_loop(loop)
-                result = loop.run_until_complete(_arun())
-            finally:
-                loop.close()
-                asyncio.set_event_loop(None)
-
-            raw_output = result.final_output or ""
+            # Identical tool calls within this analysis are answered without re-running them
+            start_call_tracking()
+            # execute_python_code results are decoded by the Excel agent's hooks as they arrive
+            tool_results = start_result_collection()
             
-            # Extract dataframe and images from tool output
-            extracted_df = None
-            extracted_images = []
-            final_text = raw_output
+            # Pooled MCP servers: spawned and connected once, reused by every request
+            python_server = await get_server("python")
             
-            # Extract from result.new_items - Item 1 (ToolCallOutputItem) contains the JSON
-            for item in result.new_items:
-                if hasattr(item, 'output') and isinstance(item.output, str):
-                    # Extract JSON from markdown code blocks if present
-                    json_str = item.output
-                    if "```json" in item.output:
-                        parts = item.output.split("```json")
-                        if len(parts) > 1:
-                            json_str = parts[1].split("```")[0].strip()
-                    
-                    try:
-                        tool_result = json.loads(json_str)
-                        if isinstance(tool_result, dict) and "success" in tool_result:
-                            # Extract dataframe and images from tool result
-                            if isinstance(tool_result.get("dataframe"), list) and tool_result.get("dataframe"):
-                                extracted_df = tool_result.get("dataframe")
-                            if isinstance(tool_result.get("images"), list) and tool_result.get("images"):
-                                extracted_images = tool_result.get("images")
-                            break  # Found the JSON, no need to continue
-                    except (json.JSONDecodeError, ValueError):
-                        continue
-
-            return {
-                'success': True,
-                'output': final_text,
-                'dataframe': extracted_df,
-                'images': extracted_images,
-                'code': None,
-                'error': None
-            }
+            code = fast_path.match_query(user_query) if self.use_fast_path else None
+            if code is not None:
+                yield {'type': 'tool_start', 'tool': 'execute_python_code'}
+                direct = await self._run_fast_path(python_server, code, file_path)
+                if direct is not None:
+                    yield {'type': 'final', **direct}
+                    return
+            
+            web_server = await get_server("web")
+            excel_agent, web_agent, orchestrator = self._get_agents(python_server, web_server)
+            
+            # Prepare user message with file path
+            user_msg = (
+                f"User query: {user_query}\n"
+                f"File path: {file_path}\n\n"
+                f"Call the excel_analysis_agent tool with this exact message:\n"
+                f"'Analyze this request: {user_query}\\n\\nThe file is located at: {file_path}\\n\\n"
+                f"Write Python code and call execute_python_code with that code and the same file_path.'\n\n"
+                f"Make sure to pass the complete user query to the excel_analysis_agent so it can perform the correct analysis."
+            )
+            if file_context:
+                user_msg += f"\n\nFile details (include them in the message to excel_analysis_agent):\n{file_context}"
+            
+            if self.speculative_web and WEB_HINT_PATTERN.search(user_query):
+                yield {'type': 'tool_start', 'tool': 'excel_analysis_agent'}
+                yield {'type': 'tool_start', 'tool': 'web_search_agent'}
+                direct, web_context = await self._run_speculative(
+                    excel_agent, web_agent, user_query, file_path, file_context, tool_results
+                )
+                if direct is not None:
+                    yield {'type': 'final', **direct}
+                    return
+                if web_context:
+                    user_msg += (
+                        f"\n\nWeb search results already retrieved for this query "
+                        f"(pass the relevant parts to excel_analysis_agent, no need to search again):\n{web_context}"
+                    )
+            elif self.excel_first:
+                # Routing is constant for a plain analysis: skip the orchestrator
+                # unless the Excel agent cannot answer on its own
+                yield {'type': 'tool_start', 'tool': 'excel_analysis_agent'}
+                direct, failure = await self._run_direct(excel_agent, user_query, file_path, file_context, tool_results)
+                if direct is not None:
+                    yield {'type': 'final', **direct}
+                    return
+                if failure:
+                    user_msg += (
+                        f"\n\nA first excel_analysis_agent attempt already failed with:\n{failure}\n"
+                        f"Use web_search_agent to find a fix before retrying excel_analysis_agent."
+                    )
+            
+            # Run orchestrator, forwarding events as they arrive. The file schema is
+            # usually in the message, so no turns are spent exploring the file
+            result = Runner.run_streamed(orchestrator, user_msg, max_turns=6)
+            async for event in result.stream_events():
+                if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                    yield {'type': 'token', 'delta': event.data.delta}
+                elif event.type == "run_item_stream_event":
+                    if event.name == "tool_called":
+                        yield {'type': 'tool_start', 'tool': getattr(event.item.raw_item, "name", None)}
+                    elif event.name == "tool_output":
+                        yield {'type': 'tool_output', 'output': event.item.output}
 
         except Exception as e:
             err = f"MasterAgent error: {e}"
             logger.error(err)
-            return {
+            yield {
+                "type": "final",
                 "success": False,
                 "output": None,
                 "dataframe": None,
@@ -175,5 +274,249 @@ class MasterAgent:
                 "code": None,
                 "error": err,
             }
+            return
+
+        yield {'type': 'final', **self._extract_result(result, tool_results)}
+
+    def _get_agents(self, python_server: MCPServer, web_server: MCPServer) -> Tuple[Agent, Agent, Agent]:
+        """
+        Return the (excel, web, orchestrator) agents, built once per API key, model and servers
+        
+        Agents hold no per-run state (results and call tracking live in context
+        variables), so concurrent analyses share them. Only the AGENT_CACHE_SIZE most
+        recently used sets are kept; their clients are closed by runtime on eviction.
+        """
+        key_digest = hashlib.sha256((self.api_key or "").encode("utf-8")).hexdigest()
+        key = (key_digest, self.model, python_server, web_server)
+        with _agents_lock:
+            agents = _agents.get(key)
+            if agents is not None:
+                _agents.move_to_end(key)
+                return agents
+            
+            # All agents share one pooled OpenAI client for this API key
+            model = OpenAIResponsesModel(model=self.model, openai_client=get_openai_client(self.api_key))
+            
+            # Create specialized agents using functions from their respective modules
+            excel_agent = create_excel_agent(mcp_server=python_server, model=model)
+            web_agent = create_web_search_agent(mcp_server=web_server, model=model)
+            
+            # Create orchestrator agent with other agents as tools
+            orchestrator = Agent(
+                name="MasterAgent",
+                model=model,
+                instructions=MASTER_AGENT_PROMPT,
+                # Independent tool calls emitted in the same turn are dispatched
+                # concurrently by the Runner, so latency is max(tool_i) not sum(tool_i)
+                model_settings=ModelSettings(
+                    parallel_tool_calls=True,
+                    max_tokens=1024,
+                    temperature=0.2,
+                    extra_body={"prompt_cache_key": "excel-master-agent-v1"},
+                ),
+                tools=[
+                    excel_agent.as_tool(
+                        tool_name="excel_analysis_agent",
+                        tool_description=EXCEL_TOOL_DESCRIPTION,
+                    ),
+                    web_agent.as_tool(
+                        tool_name="web_search_agent",
+                        tool_description=WEB_TOOL_DESCRIPTION,
+                    ),
+                ],
+            )
+            agents = _agents[key] = (excel_agent, web_agent, orchestrator)
+            while len(_agents) > AGENT_CACHE_SIZE:
+                _agents.popitem(last=False)
+            return agents
+
+    async def _run_speculative(self, excel_agent: Agent, web_agent: Agent, user_query: str, file_path: str,
+                               file_context: Optional[str], tool_results: List[json_utils.ToolResult]
+                               ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Run the Excel agent directly while the web search runs concurrently
+        
+        Args:
+            excel_agent: Agent bound to execute_python_code
+            web_agent: Agent bound to search_web
+            user_query: User's natural language query
+            file_path: Path to the uploaded Excel/CSV file
+            file_context: Known facts about the file, if any
+            tool_results: execute_python_code results collected for this analysis
+            
+        Returns:
+            (result, None) when the Excel run succeeded (the search is cancelled), otherwise
+            (None, web_context) with the search output, or None if the search failed too
+        """
+        excel_msg = self._excel_message(user_query, file_path, file_context)
+        excel_task = asyncio.create_task(Runner.run(excel_agent, excel_msg, max_turns=EXCEL_MAX_TURNS))
+        web_task = asyncio.create_task(Runner.run(web_agent, user_query, max_turns=3))
+        try:
+            try:
+                excel_result = await excel_task
+            except Exception as e:
+                logger.warning("Speculative Excel run failed: %s", e)
+                excel_result = None
+            
+            tool_result = self._pick_tool_result(tool_results) if excel_result is not None else None
+            if tool_result is not None and tool_result.success:
+                web_task.cancel()
+                return self._result_from_tool(tool_result, excel_result.final_output), None
+            
+            try:
+                web_result = await web_task
+            except Exception as e:
+                logger.warning("Speculative web search failed: %s", e)
+                return None, None
+            return None, str(web_result.final_output or "") or None
+        finally:
+            for task in (excel_task, web_task):
+                if not task.done():
+                    task.cancel()
+
+    async def _run_direct(self, excel_agent: Agent, user_query: str, file_path: str,
+                          file_context: Optional[str], tool_results: List[json_utils.ToolResult]
+                          ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Run the Excel agent directly, without the orchestrator
+        
+        Returns:
+            (result, None) when the Excel run succeeded, otherwise (None, error) with
+            the last error seen, or None if there is none
+        """
+        try:
+            excel_result = await Runner.run(
+                excel_agent, self._excel_message(user_query, file_path, file_context), max_turns=EXCEL_MAX_TURNS
+            )
+        except Exception as e:
+            logger.warning("Direct Excel run failed: %s", e)
+            tool_result = self._pick_tool_result(tool_results)
+            return None, (tool_result.error if tool_result is not None else None) or str(e)
+        
+        tool_result = self._pick_tool_result(tool_results)
+        if tool_result is not None and tool_result.success:
+            return self._result_from_tool(tool_result, excel_result.final_output), None
+        logger.info("Direct Excel run did not succeed, handing over to the orchestrator")
+        return None, tool_result.error if tool_result is not None else None
+
+    @staticmethod
+    def _excel_message(user_query: str, file_path: str, file_context: Optional[str]) -> str:
+        """Build the Excel agent's input for a run without the orchestrator"""
+        excel_msg = (
+            f"Analyze this request: {user_query}\n\nThe file is located at: {file_path}\n\n"
+            f"Write Python code and call execute_python_code with that code and the same file_path."
+        )
+        if file_context:
+            excel_msg += f"\n\nFile details:\n{file_context}"
+        return excel_msg
+
+    async def _run_fast_path(self, python_server: MCPServer, code: str,
+                             file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Execute canned code for a simple query directly on the MCP server
+        
+        Returns:
+            The analyze() result, or None if the code failed (e.g. the column does not
+            exist) and the query should go through the agents
+        """
+        try:
+            call_result = await python_server.call_tool("execute_python_code", {"code": code, "file_path": file_path})
+        except Exception as e:
+            logger.warning("Fast path call failed: %s", e)
+            return None
+        # Renamed to structured_content in newer mcp releases (the old name is deprecated)
+        structured = getattr(call_result, "structured_content", None)
+        if structured is None:
+            structured = getattr(call_result, "structuredContent", None)
+        if structured is not None:
+            tool_result = json_utils.tool_result_from_dict(structured)
+        else:
+            tool_result = json_utils.decode_tool_result(call_result.content[0].text if call_result.content else "")
+        if tool_result is None or not tool_result.success:
+            logger.info("Fast path did not succeed, falling back to the agents")
+            return None
+        logger.info("Query answered by the fast path")
+        return self._result_from_tool(tool_result, code=code)
+
+    @staticmethod
+    def _result_from_tool(tool_result: json_utils.ToolResult, fallback_output: Optional[str] = None,
+                          code: Optional[str] = None) -> Dict[str, Any]:
+        """Build the analyze() result from a successful execute_python_code result"""
+        return {
+            'success': True,
+            'output': tool_result.output or fallback_output or "",
+            'dataframe': tool_result.dataframe,
+            'dataframe_path': tool_result.dataframe_path,
+            'tables': tool_result.tables,
+            'images': tool_result.images or [],
+            'code': code,
+            'error': None,
+        }
+
+    @staticmethod
+    def _pick_tool_result(tool_results: List[json_utils.ToolResult]) -> Optional[json_utils.ToolResult]:
+        """Return the latest successful execute_python_code result, else the latest one, if any"""
+        for tool_result in reversed(tool_results):
+            if tool_result.success:
+                return tool_result
+        return tool_results[-1] if tool_results else None
+
+    def _extract_result(self, result: RunResultBase, tool_results: List[json_utils.ToolResult]) -> Dict[str, Any]:
+        """
+        Build the analyze() result from a finished run
+        
+        Args:
+            result: Completed orchestrator run
+            tool_results: execute_python_code results collected during the run
+            
+        Returns:
+            Dictionary with success, output, dataframe, dataframe_path, tables, images, code and error
+        """
+        raw_output = result.final_output or ""
+        
+        # Extract dataframe and images from tool output
+        extracted_df = None
+        extracted_df_path = None
+        extracted_tables = None
+        extracted_images = []
+        final_text = raw_output
+        
+        tool_result = self._pick_tool_result(tool_results)
+        if tool_result is not None:
+            extracted_df = tool_result.dataframe
+            extracted_df_path = tool_result.dataframe_path
+            extracted_tables = tool_result.tables
+            extracted_images = tool_result.images or []
+        
+        # Fallback when nothing was collected: a JSON result echoed in an agent
+        # tool's output, e.g. Item 1 (ToolCallOutputItem)
+        fallback_items = result.new_items if tool_result is None else []
+        for item in fallback_items:
+            if isinstance(item, ToolCallOutputItem) and isinstance(item.output, str):
+                # Extract JSON from markdown code blocks if present
+                fence = JSON_FENCE_PATTERN.search(item.output)
+                json_str = fence.group(1) if fence else item.output
+                
+                tool_result = json_utils.decode_tool_result(json_str)
+                if tool_result is not None:
+                    # Extract dataframe and images from tool result
+                    if tool_result.dataframe:
+                        extracted_df = tool_result.dataframe
+                    extracted_df_path = tool_result.dataframe_path
+                    extracted_tables = tool_result.tables
+                    if tool_result.images:
+                        extracted_images = tool_result.images
+                    break  # Found the JSON, no need to continue
+
+        return {
+            'success': True,
+            'output': final_text,
+            'dataframe': extracted_df,
+            'dataframe_path': extracted_df_path,
+            'tables': extracted_tables,
+            'images': extracted_images,
+            'code': None,
+            'error': None
+        }
 
 
@@ -0,0 +1,366 @@
+"""
+MCP client helpers shared by the agents
+"""
+
+import asyncio
+import atexit
+import contextvars
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import anyio
+from agents.mcp import MCPServer, MCPServerStdio
+try:
+    from mcp.shared.exceptions import McpError
+except ImportError:  # renamed in newer mcp releases
+    from mcp.shared.exceptions import MCPError as McpError
+from mcp.types import CONNECTION_CLOSED, CallToolResult, TextContent, Tool as MCPTool
+
+from . import json_utils
+from .runtime import get_event_loop, run_coroutine
+
+
+logger = logging.getLogger(__name__)
+
+
+# Tools that run sandbox code; their calls are serialized (shared matplotlib state)
+CODE_TOOL_NAMES = frozenset({"execute_python_code", "batch_execute_python_code"})
+
+DUPLICATE_CALL_MESSAGE = "Identical call already attempted in this analysis; try a different approach."
+
+# Idempotent, cached lookups: a repeat (e.g. the orchestrator asking for a search
+# the speculative run already made) gets the results again, not a refusal
+DEDUP_EXEMPT_TOOLS = frozenset({"search_web", "fetch_search_result"})
+
+# (tool name, arguments digest) of every call made during the current analysis.
+# Set per run by the caller; unset means deduplication is disabled.
+_seen_calls: contextvars.ContextVar[Optional[Set[Tuple[str, bytes]]]] = contextvars.ContextVar(
+    "mcp_seen_calls", default=None
+)
+
+
+def start_call_tracking() -> None:
+    """Start a fresh duplicate-call scope for the current analysis run"""
+    _seen_calls.set(set())
+
+
+def _call_digest(arguments: Optional[Dict[str, Any]]) -> bytes:
+    canonical = json_utils.dumps(arguments or {}, sort_keys=True)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+def _check_duplicate(tool_name: str, arguments: Optional[Dict[str, Any]]) -> Tuple[bool, Optional[Tuple[str, bytes]]]:
+    """
+    Record a tool call in the current analysis' duplicate-call scope
+    
+    Returns:
+        (is_duplicate, key); key is None when tracking is disabled or the tool is exempt
+    """
+    seen = _seen_calls.get()
+    if seen is None or tool_name in DEDUP_EXEMPT_TOOLS:
+        return False, None
+    key = (tool_name, _call_digest(arguments))
+    if key in seen:
+        return True, key
+    seen.add(key)
+    return False, key
+
+
+def _forget_call(key: Optional[Tuple[str, bytes]]) -> None:
+    """Drop a call that did not run from the duplicate-call scope, so it can be retried"""
+    seen = _seen_calls.get()
+    if seen is not None and key is not None:
+        seen.discard(key)
+
+
+class InProcessMCPServer(MCPServer):
+    """
+    MCP server that runs the app_agents.mcp_server tools in this process
+    
+    Same tools and schemas as the stdio server, but a call is a plain function
+    call on a worker thread: no subprocess, no JSON-RPC framing over pipes.
+    Executed code shares the app's memory and stdout, so only use it when every
+    user is trusted (EXCEL_AGENT_MCP_TRANSPORT=inprocess).
+    """
+
+    def __init__(self, name: str = "excel-tools-inprocess", use_structured_content: bool = False):
+        super().__init__(use_structured_content=use_structured_content)
+        self._name = name
+        self._functions: Dict[str, Any] = {}
+        self._tools: Optional[List[MCPTool]] = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    async def connect(self) -> None:
+        from fastmcp import Client
+        from . import mcp_server
+
+        self._functions = dict(mcp_server.TOOL_FUNCTIONS)
+        # Tool definitions (names, descriptions, JSON schemas) exactly as FastMCP
+        # publishes them, fetched once over its in-memory transport
+        async with Client(mcp_server.mcp) as client:
+            self._tools = await client.list_tools()
+        mcp_server.start_warmup()
+
+    async def cleanup(self) -> None:
+        self._functions = {}
+
+    async def list_tools(self, run_context: Any = None, agent: Any = None) -> List[MCPTool]:
+        if self._tools is None:
+            raise anyio.ClosedResourceError()
+        return self._tools
+
+    async def call_tool(self, tool_name: str, arguments: Optional[Dict[str, Any]], *args, **kwargs) -> CallToolResult:
+        function = self._functions.get(tool_name)
+        if function is None:
+            return CallToolResult(content=[TextContent(type="text", text=f"Unknown tool: {tool_name}")], isError=True)
+        try:
+            # Code tools serialize themselves (mcp_server._execution_lock), as they do
+            # on the stdio server's worker threads
+            output = await asyncio.to_thread(function, **(arguments or {}))
+        except Exception as e:
+            logger.error("Tool %s failed: %s", tool_name, e)
+            return CallToolResult(content=[TextContent(type="text", text=f"Error executing tool {tool_name}: {e}")], isError=True)
+        if isinstance(output, dict):
+            # Handed over as-is: the SDK serializes structured content once for the
+            # model (the python view sets use_structured_content), so no text copy is built
+            return CallToolResult(content=[], structuredContent=output)
+        return CallToolResult(content=[TextContent(type="text", text=output)])
+
+    async def list_prompts(self, *args, **kwargs) -> Any:
+        from mcp.types import ListPromptsResult
+        return ListPromptsResult(prompts=[])
+
+    async def get_prompt(self, name: str, *args, **kwargs) -> Any:
+        raise KeyError(f"Prompt not found: {name}")
+
+
+def _is_connection_error(error: Exception) -> bool:
+    """Whether an MCP call failed because the server subprocess is gone"""
+    if isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)):
+        return True
+    return isinstance(error, McpError) and error.error.code == CONNECTION_CLOSED
+
+
+MCP_SERVER_PARAMS = {"command": "python", "args": ["-m", "app_agents.mcp_server"]}
+
+# "stdio" spawns app_agents.mcp_server, keeping executed code out of the web process
+# (and away from its API keys); "inprocess" runs the tools in the app process and is
+# only meant for trusted, single-user setups
+MCP_TRANSPORT = os.getenv("EXCEL_AGENT_MCP_TRANSPORT", "stdio")
+
+# With the stdio transport, one subprocess serves both tools
+MCP_SERVER_CONFIG: Dict[str, Any] = {
+    "name": "excel-tools",
+    "params": MCP_SERVER_PARAMS,
+    "cache_tools_list": True,
+}
+
+# Per-agent views over the shared server; each agent only sees its own tools
+SERVER_VIEWS: Dict[str, Dict[str, Any]] = {
+    "python": {
+        "name": "excel-tools-python",
+        "allowed_tool_names": ["execute_python_code", "batch_execute_python_code", "fetch_search_result"],
+        "use_structured_content": True,
+    },
+    "web": {
+        "name": "excel-tools-web",
+        "allowed_tool_names": ["search_web"],
+    },
+}
+
+
+class MCPServerView(MCPServer):
+    """
+    Filtered view of a shared, already connected MCP server
+    
+    Lets several agents use one server (one subprocess and session with stdio)
+    while each of them only lists its own tools, and refuses duplicate calls
+    within an analysis. Connecting and cleaning up is left to the pool; if the
+    subprocess has died, the view gets a respawned one and retries once.
+    """
+
+    def __init__(self, server: MCPServer, name: str, allowed_tool_names: List[str],
+                 use_structured_content: bool = False):
+        super().__init__(use_structured_content=use_structured_content)
+        self._server = server
+        self._name = name
+        self._allowed_tool_names = frozenset(allowed_tool_names)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    async def connect(self) -> None:
+        pass
+
+    async def cleanup(self) -> None:
+        pass
+
+    async def list_tools(self, run_context: Any = None, agent: Any = None) -> List[MCPTool]:
+        try:
+            tools = await self._server.list_tools(run_context, agent)
+        except Exception as e:
+            if not _is_connection_error(e):
+                raise
+            self._server = await _reconnect(self._server)
+            tools = await self._server.list_tools(run_context, agent)
+        return [tool for tool in tools if tool.name in self._allowed_tool_names]
+
+    async def call_tool(self, tool_name: str, arguments: Optional[Dict[str, Any]], *args, **kwargs) -> CallToolResult:
+        # Identical calls within one analysis are refused instead of re-run
+        duplicate, key = _check_duplicate(tool_name, arguments)
+        if duplicate:
+            logger.info("Skipping duplicate %s call", tool_name)
+            return CallToolResult(content=[TextContent(type="text", text=DUPLICATE_CALL_MESSAGE)])
+        try:
+            return await self._server.call_tool(tool_name, arguments, *args, **kwargs)
+        except Exception as e:
+            if not _is_connection_error(e):
+                _forget_call(key)
+                raise
+            # The subprocess died (crash, OOM kill): respawn it and retry once
+            self._server = await _reconnect(self._server)
+            try:
+                return await self._server.call_tool(tool_name, arguments, *args, **kwargs)
+            except Exception:
+                _forget_call(key)
+                raise
+
+    async def list_prompts(self, *args, **kwargs) -> Any:
+        return await self._server.list_prompts(*args, **kwargs)
+
+    async def get_prompt(self, *args, **kwargs) -> Any:
+        return await self._server.get_prompt(*args, **kwargs)
+
+
+# The connected server, its views and the event that stops its owner task.
+# Only touched from the background event loop.
+_server: Optional[MCPServer] = None
+_views: Dict[str, MCPServerView] = {}
+_stop_event: Optional[asyncio.Event] = None
+_owner_task: Optional["asyncio.Task[None]"] = None
+_pool_lock: Optional[asyncio.Lock] = None
+
+
+async def _own_server(server: MCPServer, ready: "asyncio.Future[None]", stop: asyncio.Event) -> None:
+    """
+    Keep one server connected until stop is set
+    
+    The MCP stdio client is built on anyio task groups, which must be entered and
+    exited by the same task: a dedicated owner task connects the server and later
+    cleans it up, while request tasks only call its tools.
+    """
+    try:
+        await server.connect()
+    except Exception as e:
+        ready.set_exception(e)
+        return
+    ready.set_result(None)
+    await stop.wait()
+    try:
+        await server.cleanup()
+    except Exception as e:
+        logger.warning("Error closing MCP server %s: %s", server.name, e)
+
+
+async def _get_shared_server() -> MCPServer:
+    """Get the connected shared server, spawning it on first use (call with _pool_lock held)"""
+    global _server, _stop_event, _owner_task
+    if _server is None:
+        if MCP_TRANSPORT == "stdio":
+            server = MCPServerStdio(**MCP_SERVER_CONFIG)
+        else:
+            server = InProcessMCPServer()
+        ready = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(_own_server(server, ready, stop))
+        await ready
+        _server, _stop_event, _owner_task = server, stop, task
+        logger.info("Started pooled MCP server: %s", server.name)
+    return _server
+
+
+def _get_pool_lock() -> asyncio.Lock:
+    global _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    return _pool_lock
+
+
+async def _reconnect(dead: MCPServer) -> MCPServer:
+    """
+    Replace a shared server whose subprocess is gone with a freshly spawned one
+    
+    Safe to call from several views at once: only the first caller respawns,
+    the others get the new server.
+    """
+    global _server, _stop_event, _owner_task
+    async with _get_pool_lock():
+        if _server is dead:
+            logger.warning("MCP server %s disconnected, respawning it", dead.name)
+            task, stop = _owner_task, _stop_event
+            _server = _stop_event = _owner_task = None
+            if stop is not None:
+                stop.set()
+            if task is not None:
+                # cleanup() of the dead connection may fail; _own_server logs it
+                await task
+        return await _get_shared_server()
+
+
+async def get_server(key: str) -> MCPServer:
+    """
+    Get a pooled MCP server exposing one agent's tools, spawning the shared
+    subprocess on first use
+    
+    Must be awaited on the background event loop (see runtime.run_coroutine).
+    
+    Args:
+        key: View key in SERVER_VIEWS ("python" or "web")
+        
+    Returns:
+        Connected server view shared by all requests
+    """
+    async with _get_pool_lock():
+        view = _views.get(key)
+        if view is None:
+            view = MCPServerView(await _get_shared_server(), **SERVER_VIEWS[key])
+            _views[key] = view
+    return view
+
+
+def invalidate_tools_cache() -> None:
+    """
+    Make the pooled server fetch its tool list again on next use
+    
+    The list is cached for the lifetime of the subprocess (cache_tools_list=True);
+    only call this if the tools exposed by app_agents.mcp_server change at runtime.
+    """
+    if isinstance(_server, MCPServerStdio):
+        _server.invalidate_tools_cache()
+
+
+async def close_servers() -> None:
+    """Disconnect the pooled server and wait for its subprocess to exit"""
+    global _server, _stop_event, _owner_task
+    task, stop = _owner_task, _stop_event
+    _server = _stop_event = _owner_task = None
+    _views.clear()
+    if stop is not None:
+        stop.set()
+    if task is not None:
+        await task
+
+
+@atexit.register
+def _shutdown_servers() -> None:
+    if _owner_task is not None:
+        try:
+            run_coroutine(close_servers(), timeout=10)
+        except Exception as e:
+            logger.warning("Error shutting down MCP servers: %s", e)
@@ -1,42 +1,298 @@
 """
-MCP stdio server exposing execute_python_code and search_web tools (FastMCP)
+MCP server exposing the code execution and web search tools (FastMCP)
 """
 
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
 from fastmcp import FastMCP
 
 
+logger = logging.getLogger(__name__)
+
 mcp = FastMCP("excel-tools")
 
 # Lazy singletons to avoid heavy imports at startup
 _python_tool = None
+_python_tool_lock = threading.Lock()
 _web_tool = None
+_web_tool_lock = threading.Lock()
+
+# FastMCP runs sync tools concurrently on worker threads, but executed code shares
+# process-global state (pyplot's figure registry, the redirected sys.stdout/stderr):
+# one execution or batch at a time, so concurrent analyses never see each other's
+# output or figures
+_execution_lock = threading.Lock()
+
+# Figures and result dataframes are saved here and returned by path; the server
+# runs on the same host as the UI, which reads them directly from disk
+OUTPUT_DIR = os.getenv("EXCEL_AGENT_OUTPUT_DIR") or os.path.join(tempfile.gettempdir(), "excel_agent_outputs")
+
+# Search results longer than SEARCH_SUMMARY_CHARS are returned as a summary plus
+# a file:// URL to the full text (content-addressed by query), which the agent
+# fetches with fetch_search_result only when the summary is not enough
+SEARCH_CACHE_DIR = os.path.join(OUTPUT_DIR, "search_cache")
+SEARCH_SUMMARY_CHARS = 1200
+
+# Output files older than OUTPUT_TTL seconds are deleted at startup and, at most
+# every OUTPUT_CLEANUP_INTERVAL seconds, after a tool writes new ones
+OUTPUT_TTL = int(os.getenv("EXCEL_AGENT_OUTPUT_TTL", "3600"))
+OUTPUT_CLEANUP_INTERVAL = 60
+# Only files the tools write are removed from OUTPUT_DIR, which may be shared
+_OUTPUT_SUFFIXES = (".png", ".feather")
+_last_cleanup = 0.0
+_cleanup_lock = threading.Lock()
+
+# Error signatures that a documentation lookup can usually fix, mapped to the
+# search query template used to look them up
+_ERROR_SEARCH_PATTERNS = [
+    (re.compile(r"has no attribute '(\w+)'"), "pandas AttributeError has no attribute '{0}'"),
+    (re.compile(r"name '(\w+)' is not defined"), "python pandas NameError name '{0}' is not defined"),
+    (re.compile(r"Cannot import '([\w.]+)'"), "pandas alternative to {0}"),
+    (re.compile(r"unexpected keyword argument '(\w+)'"), "pandas unexpected keyword argument '{0}'"),
+]
+
+
+# Successful execute_python_code results by (code, file path, file mtime/size),
+# least recently used first: agent retries and repeated analyses of the same
+# file skip execution entirely
+EXECUTION_CACHE_SIZE = 128
+_execution_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_execution_cache_lock = threading.Lock()
 
+# Code whose output can change between identical runs is never cached
+_NONDETERMINISTIC_CODE = re.compile(
+    r"\brandom\b|\.sample\(|\bnow\(|\btoday\(|\btime\.time\(|\buuid\b|\brequests\b|\burllib\b"
+)
 
-@mcp.tool
-def execute_python_code(code: str, file_path: str) -> str:
-    """Execute Python code and return results as JSON string to avoid MCP serialization issues"""
-    import json
+
+def _get_python_tool():
     global _python_tool
-    if _python_tool is None:
-        from app_agents.tools.python_tool import PythonSandboxTool
-        _python_tool = PythonSandboxTool(timeout=30)
-    result = _python_tool.execute(code=code, file_path=file_path)
-    return json.dumps(result, ensure_ascii=False)
+    with _python_tool_lock:
+        if _python_tool is None:
+            from app_agents.tools.python_tool import PythonSandboxTool
+            _python_tool = PythonSandboxTool(timeout=30, image_dir=OUTPUT_DIR, dataframe_dir=OUTPUT_DIR)
+    return _python_tool
 
 
-@mcp.tool
-def search_web(query: str) -> str:
+def _get_web_tool():
     global _web_tool
-    if _web_tool is None:
-        from app_agents.tools.web_search_tool import WebSearchTool
-        _web_tool = WebSearchTool(max_results=5)
-    res = _web_tool.search(query)
+    with _web_tool_lock:
+        if _web_tool is None:
+            from app_agents.tools.web_search_tool import WebSearchTool
+            _web_tool = WebSearchTool(max_results=5)
+    return _web_tool
+
+
+def cleanup_outputs(force: bool = False) -> int:
+    """
+    Delete figures, result dataframes and stored search results older than OUTPUT_TTL
+    
+    Args:
+        force: Run even if the last cleanup was less than OUTPUT_CLEANUP_INTERVAL ago
+        
+    Returns:
+        Number of files deleted
+    """
+    global _last_cleanup
+    now = time.time()
+    with _cleanup_lock:
+        if not force and now - _last_cleanup < OUTPUT_CLEANUP_INTERVAL:
+            return 0
+        _last_cleanup = now
+    cutoff = now - OUTPUT_TTL
+    removed = 0
+    for directory, suffixes in ((OUTPUT_DIR, _OUTPUT_SUFFIXES), (SEARCH_CACHE_DIR, None)):
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if suffixes and not entry.name.endswith(suffixes):
+                    continue
+                try:
+                    if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+    if removed:
+        logger.info("Removed %s expired output files", removed)
+    return removed
+
+
+def _search_query_for_error(error: str):
+    """Build a web search query from a sandbox error, or None if it is not a known signature"""
+    for pattern, template in _ERROR_SEARCH_PATTERNS:
+        match = pattern.search(error or "")
+        if match:
+            return template.format(*match.groups())
+    return None
+
+
+def _execution_cache_key(code: str, file_path: str) -> Optional[str]:
+    """Cache key for an execution, or None if it must not be cached"""
+    if _NONDETERMINISTIC_CODE.search(code):
+        return None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    digest = hashlib.sha256()
+    for part in (code, file_path, str(stat.st_mtime_ns), str(stat.st_size)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _execution_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with _execution_cache_lock:
+        cached = _execution_cache.get(key)
+        if cached is None:
+            return None
+        # Figures and dataframes are returned by path; a cleaned-up output dir invalidates the entry
+        paths = list(cached.get("images") or []) + [cached.get("dataframe_path")]
+        if not all(os.path.exists(path) for path in paths if path and os.path.isabs(path)):
+            del _execution_cache[key]
+            return None
+        _execution_cache.move_to_end(key)
+        return dict(cached)
+
+
+def _execution_cache_put(key: str, result: Dict[str, Any]) -> None:
+    with _execution_cache_lock:
+        _execution_cache[key] = dict(result)
+        _execution_cache.move_to_end(key)
+        while len(_execution_cache) > EXECUTION_CACHE_SIZE:
+            _execution_cache.popitem(last=False)
+
+
+def execute_python_code(code: str, file_path: str) -> Dict[str, Any]:
+    """Execute Python code and return the result dict as structured content (figures and dataframes by path)"""
+    cache_key = _execution_cache_key(code, file_path)
+    if cache_key is not None:
+        cached = _execution_cache_get(cache_key)
+        if cached is not None:
+            logger.info("Execution cache hit")
+            return cached
+    
+    python_tool = _get_python_tool()
+    with _execution_lock:
+        result = python_tool.execute(code=code, file_path=file_path)
+    cleanup_outputs()
+    if result['success'] and cache_key is not None:
+        _execution_cache_put(cache_key, result)
+    if not result['success']:
+        # Look up well-known errors right away so the agent can fix the code in
+        # its next turn instead of round-tripping through the WebSearchAgent
+        query = _search_query_for_error(result['error'])
+        if query:
+            web_tool = _get_web_tool()
+            res = web_tool.search(query)
+            if res.get("success") and res["results"]:
+                result['web_context'] = _search_summary(query, web_tool.format_results(res["results"]))
+    return result
+
+
+def batch_execute_python_code(snippets: List[str], file_path: str, stop_on_error: bool = True,
+                              timeout_ms: int = 30000) -> Dict[str, Any]:
+    """Run several Python code snippets in order, sharing variables (load the file once), and return one combined result (timeout_ms applies per snippet, at most 30000)"""
+    if timeout_ms <= 0:
+        return {
+            'success': False, 'output': '', 'error': f"timeout_ms must be positive, got {timeout_ms}",
+            'dataframe': None, 'dataframe_path': None, 'images': [], 'completed': 0,
+        }
+    python_tool = _get_python_tool()
+    # The model picks timeout_ms: never beyond the sandbox's own per-run limit
+    timeout = min(timeout_ms / 1000, python_tool.timeout)
+    with _execution_lock:
+        result = python_tool.execute_batch(
+            snippets, file_path=file_path, stop_on_error=stop_on_error, timeout=timeout
+        )
+    cleanup_outputs()
+    return result
+
+
+def _search_summary(query: str, text: str) -> str:
+    """Return text as-is if short, else its first SEARCH_SUMMARY_CHARS plus the URL of the full text"""
+    if len(text) <= SEARCH_SUMMARY_CHARS:
+        return text
+    name = hashlib.sha256(query.strip().encode("utf-8")).hexdigest() + ".txt"
+    path = os.path.join(SEARCH_CACHE_DIR, name)
+    try:
+        os.makedirs(SEARCH_CACHE_DIR, exist_ok=True)
+        # Written to a temp name and renamed, so concurrent readers never see a partial file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=SEARCH_CACHE_DIR, delete=False) as f:
+            f.write(text)
+        os.replace(f.name, path)
+        cleanup_outputs()
+    except OSError as e:
+        logger.warning("Could not store search results: %s", e)
+        return text
+    summary = text[:SEARCH_SUMMARY_CHARS].rsplit("\n", 1)[0]
+    return f"{summary}\n...\nFull results: {pathlib.Path(path).as_uri()}"
+
+
+def search_web(query: str) -> str:
+    web_tool = _get_web_tool()
+    res = web_tool.search(query)
     if res.get("success"):
-        return _web_tool.format_results(res["results"])
+        return _search_summary(query, web_tool.format_results(res["results"]))
     return f"Search failed: {res.get('error', 'Unknown error')}"
 
 
+def fetch_search_result(url: str) -> str:
+    """Return the full text of search results summarized by search_web (url is the 'Full results' file:// URL)"""
+    path = os.path.realpath(url2pathname(urlparse(url).path) if url.startswith("file:") else url)
+    if os.path.dirname(path) != os.path.realpath(SEARCH_CACHE_DIR):
+        return "Unknown search result URL"
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return "Search result no longer available"
+
+
+# Registered explicitly so the module-level names stay plain functions that the
+# in-process server (mcp_client.InProcessMCPServer) can call directly
+TOOL_FUNCTIONS = {
+    "execute_python_code": execute_python_code,
+    "batch_execute_python_code": batch_execute_python_code,
+    "search_web": search_web,
+    "fetch_search_result": fetch_search_result,
+}
+for _tool_function in TOOL_FUNCTIONS.values():
+    mcp.tool(_tool_function)
+
+
+def start_warmup() -> None:
+    """
+    Remove expired outputs, import pandas/matplotlib and warm up the search session in a background thread,
+    while the client handshakes and the model generates its first tool call; a call
+    arriving earlier waits on the singleton lock instead of building a second tool
+    """
+    def _warmup():
+        cleanup_outputs(force=True)
+        _get_python_tool()
+        _get_web_tool()
+    threading.Thread(target=_warmup, name="tools-warmup", daemon=True).start()
+
+
 if __name__ == "__main__":
+    # Logging is configured by the entry point; stderr keeps stdout free for the MCP protocol
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    start_warmup()
     # stdio is the default; we specify it explicitly for clarity
     mcp.run(transport="stdio")
 
@@ -0,0 +1,187 @@
+"""
+Shared async runtime for the agents
+One background event loop and one pooled OpenAI client per API key, reused across requests
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Coroutine, Iterator, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+# Connection pool limits: keep-alive connections are reused across requests and
+# HTTP/2 multiplexes concurrent model calls (e.g. parallel agent tools) over one
+# TCP connection
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 50
+
+# Per-call timeouts (seconds) instead of the client's 10 minute default: a stuck
+# request fails fast and is retried with exponential backoff (0.5s, 1s, 2s, ...
+# plus jitter) by the client. For streamed calls the read timeout also bounds the
+# wait for the first token.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+WRITE_TIMEOUT = 10
+POOL_TIMEOUT = 5
+MAX_RETRIES = 3
+
+# Clients kept for the most recently used API keys; an evicted client is closed
+# once CLIENT_CLOSE_DELAY seconds have passed, so runs still using it can finish
+CLIENT_CACHE_SIZE = 8
+CLIENT_CLOSE_DELAY = 300
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+# sha256 of the API key -> client, least recently used first
+_clients: "OrderedDict[str, AsyncOpenAI]" = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def _new_event_loop() -> asyncio.AbstractEventLoop:
+    """Create a uvloop loop (libuv, faster HTTP and subprocess IO) when installed, else a default one"""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.new_event_loop()
+    return uvloop.new_event_loop()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the background event loop, starting it on first use
+    
+    All agent coroutines run on this loop so that async resources bound to it
+    (pooled HTTP connections) survive between requests.
+    
+    Returns:
+        Running event loop owned by a daemon thread (uvloop when available)
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = _new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="agents-event-loop", daemon=True).start()
+    return _loop
+
+
+def run_coroutine(coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the background loop and wait for its result
+    
+    Args:
+        coro: Coroutine to run
+        timeout: Maximum seconds to wait (default: no limit)
+        
+    Returns:
+        The coroutine's result
+        
+    Raises:
+        concurrent.futures.TimeoutError: If timeout expires; the coroutine is cancelled
+            so it does not keep running (and holding connections) in the background
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+def iterate_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    """
+    Consume an async iterator from synchronous code, one item at a time
+    
+    The whole iteration runs as a single task on the background loop, so context
+    variables set by the generator (e.g. the per-analysis tool result collector)
+    stay visible across its yields. Items are handed to the caller (e.g. a Gradio
+    worker thread) through a queue as soon as they are produced.
+    
+    Args:
+        agen: Async generator to consume
+        
+    Yields:
+        Items produced by agen
+        
+    Raises:
+        Any exception raised by agen
+    """
+    items: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+    finished = threading.Event()
+    end = object()
+
+    async def _drive() -> None:
+        try:
+            async for item in agen:
+                items.put(item)
+        finally:
+            try:
+                # Runs the generator's cleanup (e.g. closing MCP servers) if it was cancelled
+                await agen.aclose()
+            finally:
+                finished.set()
+
+    future = asyncio.run_coroutine_threadsafe(_drive(), get_event_loop())
+    future.add_done_callback(lambda _: items.put(end))
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                # Re-raises the generator's exception, if any
+                future.result()
+                return
+            yield item
+    finally:
+        if not future.done():
+            # Stopped early: cancel the task and wait for the generator's cleanup
+            future.cancel()
+            finished.wait()
+
+
+def get_openai_client(api_key: Optional[str] = None) -> "AsyncOpenAI":
+    """
+    Get the shared AsyncOpenAI client for an API key
+    
+    Args:
+        api_key: OpenAI API key (default: read OPENAI_API_KEY from the environment)
+        
+    Returns:
+        AsyncOpenAI client with a pooled HTTP/2 connection, per-call timeouts and retries;
+        only use it from the background loop
+    """
+    key = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+        else:
+            # Imported here: openai/httpx are only needed once a request is served
+            import httpx
+            from openai import AsyncOpenAI
+            limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+            timeout = httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT)
+            client = AsyncOpenAI(
+                api_key=api_key,
+                timeout=timeout,
+                max_retries=MAX_RETRIES,
+                http_client=httpx.AsyncClient(http2=True, limits=limits, timeout=timeout),
+            )
+            _clients[key] = client
+            while len(_clients) > CLIENT_CACHE_SIZE:
+                _, evicted = _clients.popitem(last=False)
+                asyncio.run_coroutine_threadsafe(_close_later(evicted), get_event_loop())
+    return client
+
+
+async def _close_later(client: "AsyncOpenAI") -> None:
+    """Close an evicted client's HTTP connections after CLIENT_CLOSE_DELAY seconds"""
+    await asyncio.sleep(CLIENT_CLOSE_DELAY)
+    await client.close()
@@ -3,9 +3,16 @@ Tools package for Excel Analyst Agent
 Contains Python sandbox and web search tools
 """
 
-from .python_tool import PythonSandboxTool
-from .web_search_tool import WebSearchTool
-
 __all__ = ["PythonSandboxTool", "WebSearchTool"]
 
 
+def __getattr__(name):
+    # Resolved lazily so importing one tool does not pull in the other's heavy
+    # dependencies (pandas/matplotlib for the sandbox, ddgs for web search)
+    if name == "PythonSandboxTool":
+        from .python_tool import PythonSandboxTool
+        return PythonSandboxTool
+    if name == "WebSearchTool":
+        from .web_search_tool import WebSearchTool
+        return WebSearchTool
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
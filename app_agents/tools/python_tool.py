@@ -4,81 +4,276 @@ Uses standard exec() with AST validation and namespace control
 """
 
 import io
+import json
+import os
 import sys
+import tempfile
 import base64
+import hashlib
+import importlib
 import logging
+import re
+import signal
 import ast
-from typing import Dict, Any, Optional, Set
+import threading
+import warnings
+from collections import OrderedDict
+from types import CodeType, ModuleType
+from typing import Dict, Any, List, Optional, Set, Tuple
 from contextlib import redirect_stdout, redirect_stderr
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import pandas as pd
 import numpy as np
 import matplotlib
 matplotlib.use('Agg')  # Non-interactive backend
 import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-
-class TimeoutException(Exception):
-    """Exception raised when code execution times out"""
+# python-calamine (Rust) parses .xlsx files many times faster than openpyxl: make it
+# the engine every pd.read_excel call uses when it is installed (pandas >= 2.2)
+try:
+    import python_calamine  # noqa: F401
+    pd.set_option('io.excel.xlsx.reader', 'calamine')
+except (ImportError, ValueError):
     pass
 
 
-class CodeValidator(ast.NodeVisitor):
+# Built once at import: the definition is static and identical for every instance
+PYTHON_TOOL_DEFINITION: Dict[str, Any] = {
+    "type": "function",
+    "function": {
+        "name": "execute_python_code",
+        "strict": True,
+        "description": "Execute Python code to analyze Excel/CSV data. Use pandas (pd), numpy (np), matplotlib (plt), and seaborn (sns). The uploaded file path is available as 'file_path' variable. Store results in 'df' or 'result' variable to return dataframes.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "code": {
+                    "type": "string",
+                    "description": "Python code to execute. Must use pandas to read the file (e.g., pd.read_excel(file_path) or pd.read_csv(file_path)). Store final dataframe in 'df' or 'result' variable."
+                }
+            },
+            "required": ["code"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+# Import names the sandbox's __import__ resolves to pre-loaded modules
+# (seaborn is loaded on first import, see _seaborn)
+_ALLOWED_MODULES: Dict[str, Any] = {
+    'pandas': pd,
+    'numpy': np,
+    'matplotlib': matplotlib,
+}
+
+# Top-level packages whose modules sandboxed code may reach through getattr
+_SANDBOX_PACKAGES = frozenset(_ALLOWED_MODULES) | {'seaborn'}
+
+# Scripts that use seaborn without importing it get sns/seaborn in their globals
+_SEABORN_NAMES = re.compile(r"\b(?:sns|seaborn)\b")
+
+
+def _seaborn():
+    """Import seaborn on first use: it pulls in scipy and most scripts never touch it"""
+    import seaborn
+    return seaborn
+
+
+# pandas display options while user code runs, so printed frames are not truncated.
+# Scoped with option_context: the tools may share the process (and pandas' global
+# options) with the UI
+DISPLAY_OPTIONS = (
+    'display.max_columns', None,
+    'display.width', 2000,
+    'display.max_colwidth', None,
+    'display.expand_frame_repr', False,
+)
+
+def _prewarm_io() -> None:
     """
-    AST validator to block dangerous operations
+    Cold start amortization: load the Excel readers and the Feather/JSON writers
+    pandas only imports on first use, so the first user script does not pay for them
     """
+    for module in ('python_calamine', 'openpyxl', 'pyarrow.feather'):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    try:
+        pd.DataFrame({'a': [1]}).to_json(orient='records')
+    except Exception:
+        pass
+
+
+# Rows of the result dataframe (and of each table) returned inline as a preview
+PREVIEW_ROWS = 5
+
+# Rows of the result dataframe written to its Feather file for the UI table
+DATAFRAME_FILE_ROWS = 1000
+
+# Worker threads of one PythonSandboxTool; an execution that finds every worker
+# busy (including runs abandoned after a timeout) is rejected instead of queued
+SANDBOX_WORKERS = 4
+
+# Compiled snippets kept per PythonSandboxTool
+CODE_CACHE_SIZE = 128
+
+# SIGALRM timeouts need POSIX interval timers (not available on Windows)
+_ALARM_AVAILABLE = hasattr(signal, 'setitimer') and hasattr(signal, 'SIGALRM')
+
+
+# Interval at which an unhandled SIGALRM timeout is raised again
+ALARM_REPEAT = 0.1
+
+
+class TimeoutException(BaseException):
+    """
+    Exception raised when code execution times out
     
-    # Dangerous functions/modules to block
-    BLOCKED_NAMES: Set[str] = {
-        'eval', 'exec', 'compile',
-        'open', 'file', 'input', 'raw_input',
-        'execfile', 'reload', 'breakpoint',
-        'exit', 'quit', 'help',
-    }
-    
-    # Dangerous modules to block
-    BLOCKED_MODULES: Set[str] = {
-        'os', 'sys', 'subprocess', 'socket', 'urllib',
-        'requests', 'http', 'ftplib', 'telnetlib',
-        'pickle', 'shelve', 'marshal', 'importlib',
-    }
+    Derived from BaseException so sandboxed code catching Exception cannot swallow it.
+    """
+    pass
+
+
+# Dangerous functions/modules to block
+BLOCKED_NAMES = frozenset({
+    'eval', 'exec', 'compile',
+    'open', 'file', 'input', 'raw_input',
+    'execfile', 'reload', 'breakpoint',
+    'exit', 'quit', 'help',
+})
+
+# Dangerous modules to block
+BLOCKED_MODULES = frozenset({
+    'os', 'sys', 'subprocess', 'socket', 'urllib',
+    'requests', 'http', 'ftplib', 'telnetlib',
+    'pickle', 'shelve', 'marshal', 'importlib',
+})
+
+# Dunder attributes that stay accessible
+_ALLOWED_DUNDERS = frozenset({'__init__', '__str__', '__repr__'})
+
+
+# Any of these words (or a dunder) in the source means the AST has to be checked;
+# clean analysis code skips the walk. Word boundaries keep e.g. 'file_path' from
+# matching 'file'
+_BLOCKED_TOKEN_PATTERN = re.compile(
+    r"__|\b(?:" + "|".join(sorted(BLOCKED_NAMES | BLOCKED_MODULES)) + r")\b"
+)
+
+
+def needs_validation(code: str) -> bool:
+    """
+    Cheap pre-filter run before validate_code
     
-    def __init__(self):
-        self.errors = []
+    Non-ASCII source is always validated: identifiers are NFKC-normalized by the
+    parser, so e.g. a fullwidth 'ｅｖａｌ' becomes the name 'eval' without the
+    word appearing in the text.
+    """
+    return not code.isascii() or _BLOCKED_TOKEN_PATTERN.search(code) is not None
+
+
+def _code_objects(code: CodeType):
+    """Yield a code object and every code object nested in it (functions, classes, comprehensions)"""
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            yield from _code_objects(const)
+
+
+def has_suspicious_names(byte_code: CodeType) -> bool:
+    """
+    Second pre-filter, on the compiled code, for sources needs_validation flagged
     
-    def visit_Import(self, node):
-        """Check import statements"""
-        for alias in node.names:
-            module_name = alias.name.split('.')[0]
-            if module_name in self.BLOCKED_MODULES:
-                self.errors.append(f"Import of '{alias.name}' is not allowed")
-        self.generic_visit(node)
+    Every name the code uses (globals, attributes and imported modules in co_names;
+    locals, cell and free variables) is recorded in its code objects. If none is a
+    blocked name, a blocked module (dotted imports by their root) or a dunder, the
+    match was in a string or comment and validate_code would find nothing.
+    """
+    for code in _code_objects(byte_code):
+        for names in (code.co_names, code.co_varnames, code.co_cellvars, code.co_freevars):
+            for name in names:
+                if (name in BLOCKED_NAMES or name.partition('.')[0] in BLOCKED_MODULES
+                        or name.startswith('__')):
+                    return True
+    return False
+
+
+def validate_code(tree: ast.AST) -> List[str]:
+    """
+    Check a parsed script for dangerous operations
     
-    def visit_ImportFrom(self, node):
-        """Check from-import statements"""
-        if node.module:
-            module_name = node.module.split('.')[0]
-            if module_name in self.BLOCKED_MODULES:
-                self.errors.append(f"Import from '{node.module}' is not allowed")
-        self.generic_visit(node)
+    One ast.walk pass with exact type checks (AST node classes are leaf types)
+    instead of a NodeVisitor method dispatch per node.
     
-    def visit_Name(self, node):
-        """Check for blocked names"""
-        if node.id in self.BLOCKED_NAMES:
-            self.errors.append(f"Use of '{node.id}' is not allowed")
-        self.generic_visit(node)
+    Args:
+        tree: Module returned by ast.parse
+        
+    Returns:
+        Error messages, empty if the code is allowed
+    """
+    errors = []
+    for node in ast.walk(tree):
+        node_type = type(node)
+        if node_type is ast.Name:
+            if node.id in BLOCKED_NAMES:
+                errors.append(f"Use of '{node.id}' is not allowed")
+        elif node_type is ast.Attribute:
+            # Block access to __builtins__, __globals__, etc.
+            attr = node.attr
+            if attr.startswith('__') and attr.endswith('__') and attr not in _ALLOWED_DUNDERS:
+                errors.append(f"Access to '{attr}' is not allowed")
+            elif attr in BLOCKED_MODULES:
+                # Modules re-exported by allowed ones, e.g. pd.io.common.os
+                errors.append(f"Access to '{attr}' is not allowed")
+        elif node_type is ast.Import:
+            for alias in node.names:
+                if alias.name.split('.')[0] in BLOCKED_MODULES:
+                    errors.append(f"Import of '{alias.name}' is not allowed")
+        elif node_type is ast.ImportFrom:
+            if node.module and node.module.split('.')[0] in BLOCKED_MODULES:
+                errors.append(f"Import from '{node.module}' is not allowed")
+    return errors
+
+
+def _check_attribute_name(name: Any) -> None:
+    """
+    Apply validate_code's attribute rules to a name only known at run time
+    (e.g. getattr(obj, '__dict' + '__'))
     
-    def visit_Attribute(self, node):
-        """Check for dangerous attribute access"""
-        # Block access to __builtins__, __globals__, etc.
-        if isinstance(node.attr, str) and node.attr.startswith('__') and node.attr.endswith('__'):
-            if node.attr not in {'__init__', '__str__', '__repr__'}:
-                self.errors.append(f"Access to '{node.attr}' is not allowed")
-        self.generic_visit(node)
+    Raises:
+        AttributeError: If the name is a blocked dunder or module
+    """
+    if isinstance(name, str) and (
+        (name.startswith('__') and name.endswith('__') and name not in _ALLOWED_DUNDERS)
+        or name in BLOCKED_MODULES
+    ):
+        raise AttributeError(f"Access to '{name}' is not allowed")
+
+
+def _safe_getattr(obj: Any, name: str, *default: Any) -> Any:
+    """getattr for sandboxed code: no blocked names, and no modules outside the allowed packages"""
+    _check_attribute_name(name)
+    value = getattr(obj, name, *default)
+    if isinstance(value, ModuleType) and value.__name__.partition('.')[0] not in _SANDBOX_PACKAGES:
+        raise AttributeError(f"Access to module '{value.__name__}' is not allowed")
+    return value
+
+
+def _safe_hasattr(obj: Any, name: str) -> bool:
+    """hasattr for sandboxed code"""
+    _check_attribute_name(name)
+    return hasattr(obj, name)
+
+
+def _safe_setattr(obj: Any, name: str, value: Any) -> None:
+    """setattr for sandboxed code"""
+    _check_attribute_name(name)
+    setattr(obj, name, value)
 
 
 class PythonSandboxTool:
@@ -86,14 +281,39 @@ class PythonSandboxTool:
     Safe Python code execution sandbox with restricted access
     """
     
-    def __init__(self, timeout: int = 30):
+    def __init__(self, timeout: int = 30, image_dir: Optional[str] = None,
+                 dataframe_dir: Optional[str] = None):
         """
         Initialize the sandbox tool
         
         Args:
             timeout: Maximum execution time in seconds (default: 30)
+            image_dir: Directory where figures are saved as PNG files; their paths are
+                returned instead of base64 strings (default: None, return base64)
+            dataframe_dir: Directory where the result dataframe is also written as a Feather
+                file, returned as 'dataframe_path' (default: None; requires pyarrow)
         """
         self.timeout = timeout
+        # blake2b(code) -> (byte_code, error), least recently used first
+        self._code_cache: "OrderedDict[bytes, Tuple[Optional[CodeType], Optional[str]]]" = OrderedDict()
+        self._code_cache_lock = threading.Lock()
+        # One slot per worker thread, released when the code on it actually finishes
+        self._worker_slots = threading.BoundedSemaphore(SANDBOX_WORKERS)
+        # Runs abandoned after a timeout that are still executing: they keep writing to
+        # the redirected stdout and pyplot, so no new run starts until they finish
+        self._abandoned: Set[Future] = set()
+        # Per-thread stdout/stderr capture buffers, reset between executions
+        self._tls = threading.local()
+        self.image_dir = image_dir
+        self.dataframe_dir = dataframe_dir
+        for directory in (image_dir, dataframe_dir):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        # Long-lived worker threads for code execution, so a call does not pay thread
+        # creation and join. A run that times out cannot be killed: its thread keeps
+        # running (and holds its slot) until the code finishes, and the other workers
+        # serve new calls meanwhile
+        self._executor = ThreadPoolExecutor(max_workers=SANDBOX_WORKERS, thread_name_prefix="sandbox")
         self.allowed_modules = {
             'pd': pd,
             'pandas': pd,
@@ -101,9 +321,9 @@ class PythonSandboxTool:
             'numpy': np,
             'plt': plt,
             'matplotlib': matplotlib,
-            'sns': sns,
-            'seaborn': sns,
         }
+        self._safe_globals_template = self._build_safe_globals_template()
+        _prewarm_io()
     
     def _safe_import(self, name, globals=None, locals=None, fromlist=(), level=0):
         """
@@ -122,17 +342,12 @@ class PythonSandboxTool:
         Raises:
             ImportError: If module is not allowed
         """
-        # Map import names to allowed modules
-        allowed = {
-            'pandas': pd,
-            'numpy': np,
-            'matplotlib': matplotlib,
-            'seaborn': sns,
-        }
-        
         # Return pre-loaded module if allowed
-        if name in allowed:
-            return allowed[name]
+        module = _ALLOWED_MODULES.get(name)
+        if module is not None:
+            return module
+        if name == 'seaborn':
+            return _seaborn()
         
         # Handle matplotlib sub-modules (e.g., matplotlib.pyplot)
         if name.startswith('matplotlib.'):
@@ -141,21 +356,18 @@ class PythonSandboxTool:
             return matplotlib
         
         # Check if it's a blocked module
-        if name.split('.')[0] in CodeValidator.BLOCKED_MODULES:
+        if name.partition('.')[0] in BLOCKED_MODULES:
             raise ImportError(f"Import of '{name}' is not allowed for security reasons")
         
         # For any other module not specifically allowed, raise error
         raise ImportError(f"Cannot import '{name}'. Only pandas, numpy, matplotlib, and seaborn are allowed.")
     
-    def _create_safe_globals(self, file_path: Optional[str] = None) -> Dict[str, Any]:
+    def _build_safe_globals_template(self) -> Dict[str, Any]:
         """
-        Create a safe globals dictionary with whitelisted modules
+        Build the globals every execution starts from (called once, in __init__)
         
-        Args:
-            file_path: Path to the uploaded Excel/CSV file
-            
         Returns:
-            Dictionary of safe globals
+            Dictionary of safe globals, without file_path
         """
         # Create a limited builtins dictionary
         safe_builtins = {
@@ -182,9 +394,9 @@ class PythonSandboxTool:
             'bool': bool,
             'isinstance': isinstance,
             'type': type,
-            'hasattr': hasattr,
-            'getattr': getattr,
-            'setattr': setattr,
+            'hasattr': _safe_hasattr,
+            'getattr': _safe_getattr,
+            'setattr': _safe_setattr,
             'True': True,
             'False': False,
             'None': None,
@@ -201,7 +413,7 @@ class PythonSandboxTool:
             'ZeroDivisionError': ZeroDivisionError,
             # Additional useful builtins
             'locals': locals,
-            'globals': lambda: safe_builtins,  # Return safe version
+            # 'globals' is bound per execution, see _create_safe_globals
             'dir': dir,
             'any': any,
             'all': all,
@@ -214,11 +426,30 @@ class PythonSandboxTool:
         
         # Add allowed modules (also available directly without import)
         safe_dict.update(self.allowed_modules)
+        return safe_dict
+    
+    def _create_safe_globals(self, file_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Create a safe globals dictionary with whitelisted modules
+        
+        Shallow copies of the prebuilt template: exec adds the script's names to the
+        globals, and the builtins are copied too so a script cannot leak changes to
+        them (e.g. through globals()) into later executions.
+        
+        Args:
+            file_path: Path to the uploaded Excel/CSV file
+            
+        Returns:
+            Dictionary of safe globals
+        """
+        safe_dict = self._safe_globals_template.copy()
+        safe_builtins = safe_dict['__builtins__'].copy()
+        safe_builtins['globals'] = lambda: safe_builtins  # Return safe version
+        safe_dict['__builtins__'] = safe_builtins
         
         # Add file path if provided
         if file_path:
             safe_dict['file_path'] = file_path
-            
         return safe_dict
     
     def _execute_code(self, byte_code, safe_dict, stdout_capture, stderr_capture) -> None:
@@ -231,16 +462,108 @@ class PythonSandboxTool:
             stdout_capture: StringIO for capturing stdout
             stderr_capture: StringIO for capturing stderr
         """
-        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
+        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture), pd.option_context(*DISPLAY_OPTIONS):
             exec(byte_code, safe_dict)
     
-    def execute(self, code: str, file_path: Optional[str] = None) -> Dict[str, Any]:
+    def close(self) -> None:
+        """Release the worker threads; a run still in progress is left to finish"""
+        self._executor.shutdown(wait=False)
+    
+    def _capture_buffers(self) -> Tuple[io.StringIO, io.StringIO]:
+        """Return this thread's (stdout, stderr) capture buffers, emptied"""
+        buffers = getattr(self._tls, 'buffers', None)
+        if buffers is None:
+            buffers = self._tls.buffers = (io.StringIO(), io.StringIO())
+        for buffer in buffers:
+            buffer.seek(0)
+            buffer.truncate()
+        return buffers
+    
+    def _compile(self, code: str) -> Tuple[Optional[CodeType], Optional[str]]:
+        """
+        Parse, validate and compile code, reusing the outcome for code seen before
+        
+        Agent retries and batch re-runs often submit identical code; a cache hit skips
+        compile() and validation. Clean code is compiled straight from source, without
+        building an AST.
+        
+        Returns:
+            (byte_code, None), or (None, error message) when the code has a syntax
+            error or fails security validation
+        """
+        key = hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+        with self._code_cache_lock:
+            cached = self._code_cache.get(key)
+            if cached is not None:
+                self._code_cache.move_to_end(key)
+                return cached
+        
+        try:
+            byte_code = compile(code, '<user_code>', 'exec', dont_inherit=True)
+        except SyntaxError as e:
+            logger.error("Syntax error: %s", e)
+            compiled = (None, f"Syntax error: {str(e)}")
+        else:
+            # Check for dangerous operations: the AST is only built when both the
+            # source and the compiled names look suspicious
+            errors = []
+            if needs_validation(code) and has_suspicious_names(byte_code):
+                tree = compile(code, '<user_code>', 'exec', flags=ast.PyCF_ONLY_AST, dont_inherit=True)
+                errors = validate_code(tree)
+            if errors:
+                logger.error("Validation errors: %s", errors)
+                compiled = (None, f"Security validation failed:\n" + "\n".join(errors))
+            else:
+                compiled = (byte_code, None)
+        
+        with self._code_cache_lock:
+            self._code_cache[key] = compiled
+            self._code_cache.move_to_end(key)
+            while len(self._code_cache) > CODE_CACHE_SIZE:
+                self._code_cache.popitem(last=False)
+        return compiled
+    
+    def _execute_with_alarm(self, byte_code, safe_dict, stdout_capture, stderr_capture, timeout: float) -> None:
+        """
+        Execute code inline, interrupted by SIGALRM after timeout seconds (main thread, POSIX only)
+        
+        Only for callers on the main thread (scripts, tests): both MCP transports call
+        the tools from worker threads, which always use the shared executor instead.
+        
+        Raises:
+            TimeoutException: If the code runs longer than timeout
+        """
+        def _on_alarm(signum, frame):
+            raise TimeoutException()
+        
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        # Keep firing every ALARM_REPEAT seconds until disarmed, so code that
+        # catches BaseException (or uses a bare except) is interrupted again
+        signal.setitimer(signal.ITIMER_REAL, timeout, ALARM_REPEAT)
+        try:
+            self._execute_code(byte_code, safe_dict, stdout_capture, stderr_capture)
+        finally:
+            try:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            except TimeoutException:
+                # A repeat alarm landed before the timer was disarmed
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    
+    def execute(self, code: str, file_path: Optional[str] = None,
+                namespace: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None,
+                return_preview: bool = True) -> Dict[str, Any]:
         """
         Execute Python code in a restricted environment
         
         Args:
             code: Python code to execute
             file_path: Path to the uploaded Excel/CSV file
+            namespace: Globals from a previous execution to run in, so variables are
+                shared (default: a fresh sandbox namespace)
+            timeout: Seconds before the execution is abandoned (default: self.timeout)
+            return_preview: Include the first rows of the result dataframe and tables as
+                JSON records (default: True); the Feather file is written either way
             
         Returns:
             Dictionary containing:
@@ -248,100 +571,146 @@ class PythonSandboxTool:
                 - output: str (stdout)
                 - error: str (if any)
                 - dataframe: dict (if df variable exists)
-                - images: list of base64 encoded images
+                - dataframe_path: str, full dataframe as a Feather file (with dataframe_dir)
+                - tables: dict of name -> preview records, when 'result' is a dict of dataframes
+                - images: list of PNG file paths (with image_dir) or base64 encoded images
         """
+        return self._run(code, file_path, namespace, timeout, return_preview)
+    
+    def _run(self, code: str, file_path: Optional[str], namespace: Optional[Dict[str, Any]],
+             timeout: Optional[float], return_preview: bool) -> Dict[str, Any]:
+        """Compile, run and collect the result"""
         result = {
             'success': False,
             'output': '',
             'error': '',
             'dataframe': None,
+            'dataframe_path': None,
             'images': []
         }
         
+        if self._abandoned:
+            logger.warning("Sandbox busy: %s timed-out runs still executing", len(self._abandoned))
+            result['error'] = 'Sandbox busy: a timed-out run is still executing, try again later'
+            return result
+        
         try:
-            # Validate code using AST
-            try:
-                tree = ast.parse(code, filename='<user_code>', mode='exec')
-            except SyntaxError as e:
-                result['error'] = f"Syntax error: {str(e)}"
-                logger.error(f"Syntax error: {str(e)}")
-                return result
-            
-            # Check for dangerous operations
-            validator = CodeValidator()
-            validator.visit(tree)
-            
-            if validator.errors:
-                result['error'] = f"Security validation failed:\n" + "\n".join(validator.errors)
-                logger.error(f"Validation errors: {validator.errors}")
+            # Parse, validate and compile (cached per source)
+            byte_code, error = self._compile(code)
+            if error:
+                result['error'] = error
                 return result
             
-            # Configure pandas display to avoid truncated columns/rows in printed output
-            try:
-                pd.set_option('display.max_columns', None)
-                pd.set_option('display.width', 2000)
-                pd.set_option('display.max_colwidth', None)
-                pd.set_option('display.expand_frame_repr', False)
-            except Exception:
-                pass
-
-            # Compile the validated code
-            byte_code = compile(tree, filename='<user_code>', mode='exec')
-            
             # Create safe execution environment
-            safe_dict = self._create_safe_globals(file_path)
+            safe_dict = namespace if namespace is not None else self._create_safe_globals(file_path)
+            if 'sns' not in safe_dict and _SEABORN_NAMES.search(code):
+                safe_dict['sns'] = safe_dict['seaborn'] = _seaborn()
             
-            # Capture stdout and stderr
-            stdout_capture = io.StringIO()
-            stderr_capture = io.StringIO()
+            # Capture stdout and stderr in this thread's reusable buffers
+            stdout_capture, stderr_capture = self._capture_buffers()
             
-            # Execute with timeout using ThreadPoolExecutor
             try:
-                with ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(
-                        self._execute_code,
-                        byte_code,
-                        safe_dict,
-                        stdout_capture,
-                        stderr_capture
-                    )
+                if _ALARM_AVAILABLE and threading.current_thread() is threading.main_thread():
+                    # Main-thread callers only (signals are delivered to the main thread):
+                    # a SIGALRM timer interrupts the code in place. The MCP servers call
+                    # from worker threads and take the executor path below
+                    self._execute_with_alarm(byte_code, safe_dict, stdout_capture, stderr_capture,
+                                             timeout or self.timeout)
+                else:
+                    # Execute with timeout on the shared executor, if a worker is free
+                    if not self._worker_slots.acquire(blocking=False):
+                        logger.warning("Sandbox busy: all %s workers are running", SANDBOX_WORKERS)
+                        result['error'] = 'Sandbox busy, try again'
+                        return result
+                    try:
+                        future = self._executor.submit(
+                            self._execute_code,
+                            byte_code,
+                            safe_dict,
+                            stdout_capture,
+                            stderr_capture
+                        )
+                    except BaseException:
+                        self._worker_slots.release()
+                        raise
+                    # Freed when the code returns, not when we stop waiting for it
+                    future.add_done_callback(lambda _: self._worker_slots.release())
                     # Wait for completion with timeout
-                    future.result(timeout=self.timeout)
+                    try:
+                        future.result(timeout=timeout or self.timeout)
+                    except FuturesTimeoutError:
+                        if not future.cancel():
+                            # Already running and cannot be stopped: track it until it returns
+                            self._abandoned.add(future)
+                            future.add_done_callback(self._abandoned.discard)
+                        raise
                 
                 # Get stdout
                 result['output'] = stdout_capture.getvalue()
                 
                 # Check for dataframe in the namespace
+                frame = None
                 if 'df' in safe_dict and isinstance(safe_dict['df'], pd.DataFrame):
-                    # Convert dataframe to dict and make it JSON-safe
-                    records = safe_dict['df'].head(5).to_dict('records')
-                    result['dataframe'] = self._make_json_safe_records(records)
+                    frame = safe_dict['df']
                 elif 'result' in safe_dict and isinstance(safe_dict['result'], pd.DataFrame):
-                    records = safe_dict['result'].head(5).to_dict('records')
-                    result['dataframe'] = self._make_json_safe_records(records)
+                    frame = safe_dict['result']
+                if frame is not None:
+                    if return_preview:
+                        result['dataframe'] = self._preview_records(frame)
+                    result['dataframe_path'] = self._write_dataframe(frame)
                 
-                # Capture matplotlib figures
-                figures = [plt.figure(i) for i in plt.get_fignums()]
-                for fig in figures:
-                    buf = io.BytesIO()
-                    fig.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-                    buf.seek(0)
-                    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-                    result['images'].append(img_base64)
-                    buf.close()
+                # Several tables computed by one consolidated script
+                if isinstance(safe_dict.get('result'), dict):
+                    tables = {
+                        str(name): self._as_table(value)
+                        for name, value in safe_dict['result'].items()
+                        if isinstance(value, (pd.DataFrame, pd.Series))
+                    }
+                    if tables and return_preview:
+                        result['tables'] = {
+                            name: self._preview_records(table)
+                            for name, table in tables.items()
+                        }
+                    if tables and frame is None:
+                        first_name, first_frame = next(iter(tables.items()))
+                        if return_preview:
+                            result['dataframe'] = result['tables'][first_name]
+                        result['dataframe_path'] = self._write_dataframe(first_frame)
                 
-                # Close all figures to free memory
-                plt.close('all')
+                # Capture matplotlib figures, closing each one as soon as it is written
+                # so only one figure's renderer and PNG are held at a time
+                buf = None
+                for num in plt.get_fignums():
+                    fig = plt.figure(num)
+                    if self.image_dir:
+                        # Write straight to disk: the UI serves the file by path, so
+                        # the PNG is never base64 encoded, sent as JSON and decoded again
+                        with tempfile.NamedTemporaryFile(dir=self.image_dir, suffix='.png', delete=False) as f:
+                            self._render_png(fig, f)
+                        result['images'].append(f.name)
+                    else:
+                        # One buffer, rewound for every figure
+                        if buf is None:
+                            buf = io.BytesIO()
+                        buf.seek(0)
+                        buf.truncate()
+                        self._render_png(fig, buf)
+                        result['images'].append(base64.b64encode(buf.getbuffer()).decode('ascii'))
+                    plt.close(fig)
+                if buf is not None:
+                    buf.close()
                 
                 result['success'] = True
                 logger.info("Code executed successfully")
                 
-            except FuturesTimeoutError:
-                result['error'] = f"Execution timeout: Code took longer than {self.timeout} seconds"
-                logger.error(f"Timeout: Code execution exceeded {self.timeout} seconds")
+            except (FuturesTimeoutError, TimeoutException):
+                # A runaway worker may still be writing to the buffers: never reuse them
+                self._tls.buffers = None
+                result['error'] = f"Execution timeout: Code took longer than {timeout or self.timeout} seconds"
+                logger.error("Timeout: Code execution exceeded %s seconds", timeout or self.timeout)
             except Exception as e:
                 result['error'] = f"Runtime error: {str(e)}"
-                logger.error(f"Runtime error: {str(e)}")
+                logger.error("Runtime error: %s", e)
                 
                 # Include stderr if available
                 stderr_output = stderr_capture.getvalue()
@@ -350,69 +719,176 @@ class PythonSandboxTool:
         
         except Exception as e:
             result['error'] = f"Sandbox error: {str(e)}"
-            logger.error(f"Sandbox error: {str(e)}")
+            logger.error("Sandbox error: %s", e)
 
-        logger.info(f"Result: {result}")
+        # Shapes only: output, preview records and (base64) images can be large
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Result: success=%s, %s chars output, %s preview rows, %s images, error=%.200s",
+                result['success'], len(result['output']), len(result['dataframe'] or ()),
+                len(result['images']), result['error'],
+            )
         
         return result
 
-    def _make_json_safe_records(self, records):
+    def execute_batch(self, snippets: List[str], file_path: Optional[str] = None,
+                      stop_on_error: bool = True, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Execute several snippets in order in one shared namespace
+        
+        Variables defined by a snippet (e.g. the loaded df) are visible to the next ones.
+        
+        Args:
+            snippets: Python code snippets, run in order
+            file_path: Path to the uploaded Excel/CSV file
+            stop_on_error: Skip the remaining snippets after a failure (default: True)
+            timeout: Seconds allowed per snippet (default: self.timeout)
+            
+        Returns:
+            One execute() result for the whole batch: outputs, errors and images
+            concatenated, the last dataframe, all tables, and 'completed' (number of
+            snippets run). success is True only if every snippet succeeded.
+        """
+        namespace = self._create_safe_globals(file_path)
+        batch = {
+            'success': True,
+            'output': '',
+            'error': '',
+            'dataframe': None,
+            'dataframe_path': None,
+            'images': [],
+            'completed': 0,
+        }
+        outputs = []
+        errors = []
+        for index, code in enumerate(snippets, 1):
+            step = self.execute(code, file_path=file_path, namespace=namespace, timeout=timeout)
+            batch['completed'] = index
+            if step['output']:
+                outputs.append(f"[snippet {index}]\n{step['output']}")
+            batch['images'].extend(step['images'])
+            if step.get('tables'):
+                batch.setdefault('tables', {}).update(step['tables'])
+            if step['dataframe'] is not None:
+                batch['dataframe'] = step['dataframe']
+                if batch['dataframe_path'] and batch['dataframe_path'] != step['dataframe_path']:
+                    # Superseded by this snippet's frame: only the last one is returned
+                    self._remove_file(batch['dataframe_path'])
+                batch['dataframe_path'] = step['dataframe_path']
+            if not step['success']:
+                batch['success'] = False
+                errors.append(f"[snippet {index}] {step['error']}")
+                if stop_on_error:
+                    break
+        batch['output'] = "\n".join(outputs)
+        batch['error'] = "\n".join(errors)
+        return batch
+    
+    @staticmethod
+    def _render_png(fig, target) -> None:
+        """
+        Write a figure as a 100 dpi PNG through its Agg canvas
+        
+        Figures without a layout engine are tightened once with tight_layout() instead of
+        savefig(bbox_inches='tight'), which renders the figure an extra time to
+        measure it before the real draw.
+        """
+        fig.set_dpi(100)
+        if fig.get_layout_engine() is None:
+            with warnings.catch_warnings():
+                # Figures tight_layout cannot handle are rendered as drawn
+                warnings.simplefilter('ignore')
+                fig.tight_layout()
+        canvas = fig.canvas if isinstance(fig.canvas, FigureCanvasAgg) else FigureCanvasAgg(fig)
+        canvas.print_png(target)
+    
+    @staticmethod
+    def _as_table(value) -> pd.DataFrame:
+        """Turn a Series or DataFrame into a table whose index (e.g. groupby keys) is kept as columns"""
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        if isinstance(frame.index, pd.RangeIndex):
+            return frame
+        return frame.reset_index()
+    
+    def _write_dataframe(self, df: pd.DataFrame) -> Optional[str]:
         """
-        Convert a list of dict records into JSON-serializable values:
-        - pandas.Timestamp -> ISO string
+        Write the first DATAFRAME_FILE_ROWS rows of a dataframe to a Feather file in dataframe_dir
+        
+        The UI loads it with pd.read_feather, a columnar read, instead of
+        rebuilding the frame from a list of JSON records.
+        
+        Returns:
+            Path of the file, or None when disabled or the frame cannot be written
+            (pyarrow missing, unsupported column types)
+        """
+        if not self.dataframe_dir:
+            return None
+        path = None
+        try:
+            # Feather needs string column names and a default index
+            frame = df.head(DATAFRAME_FILE_ROWS)
+            frame = frame.reset_index(drop=isinstance(frame.index, pd.RangeIndex))
+            frame.columns = [str(col) for col in frame.columns]
+            with tempfile.NamedTemporaryFile(dir=self.dataframe_dir, suffix='.feather', delete=False) as f:
+                path = f.name
+            frame.to_feather(path)
+            return path
+        except Exception as e:
+            logger.warning("Could not write dataframe file: %s", e)
+            if path:
+                self._remove_file(path)
+            return None
+    
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        """Delete an output file, ignoring one that is already gone"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _preview_records(self, frame: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        First PREVIEW_ROWS rows of a dataframe as JSON-safe records
+        
+        pandas' C JSON writer does the NaN -> null, Timestamp -> ISO and numpy ->
+        native conversions in one call; frames it rejects (e.g. duplicate column
+        names) go through the per-value conversion instead.
+        """
+        head = frame.head(PREVIEW_ROWS)
+        try:
+            # double_precision=15 (the maximum): the default of 10 rounds the values quoted to the user
+            return json.loads(head.to_json(orient='records', date_format='iso', double_precision=15,
+                                           default_handler=str))
+        except ValueError:
+            return self._make_json_safe_records(head)
+    
+    def _make_json_safe_records(self, frame: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        Convert a (small) dataframe into JSON-serializable records, column-wise:
+        - datetime columns -> ISO strings
         - numpy types -> native Python
-        - NaN -> None
+        - NaN/NaT/inf -> None
         """
-        import math
-        from datetime import datetime
-
-        def to_safe(value):
-            if isinstance(value, pd.Timestamp):
-                return value.isoformat()
-            if isinstance(value, datetime):
-                return value.isoformat()
-            if isinstance(value, np.generic):
-                # numpy scalar -> native python
-                py = value.item()
-                if isinstance(py, float) and (math.isnan(py) or py == float('inf') or py == float('-inf')):
-                    return None
-                return py
-            if isinstance(value, float):
-                if math.isnan(value) or value == float('inf') or value == float('-inf'):
-                    return None
-                return value
-            return value
-
-        safe_records = []
-        for rec in records or []:
-            safe_rec = {k: to_safe(v) for k, v in rec.items()}
-            safe_records.append(safe_rec)
-        return safe_records
+        values = frame.to_numpy(dtype=object)
+        invalid = frame.isna().to_numpy() | frame.isin([np.inf, -np.inf]).to_numpy()
+        for position, dtype in enumerate(frame.dtypes):
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                values[:, position] = [
+                    value.isoformat() if isinstance(value, pd.Timestamp) else value
+                    for value in values[:, position]
+                ]
+        values[invalid] = None
+        columns = list(frame.columns)
+        return [dict(zip(columns, row)) for row in values.tolist()]
     
     def get_tool_definition(self) -> Dict[str, Any]:
         """
         Get the tool definition for OpenAI function calling
         
         Returns:
-            Tool definition dictionary
+            Tool definition dictionary (shared module constant, do not mutate)
         """
-        return {
-            "type": "function",
-            "function": {
-                "name": "execute_python_code",
-                "description": "Execute Python code to analyze Excel/CSV data. Use pandas (pd), numpy (np), matplotlib (plt), and seaborn (sns). The uploaded file path is available as 'file_path' variable. Store results in 'df' or 'result' variable to return dataframes.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "code": {
-                            "type": "string",
-                            "description": "Python code to execute. Must use pandas to read the file (e.g., pd.read_excel(file_path) or pd.read_csv(file_path)). Store final dataframe in 'df' or 'result' variable."
-                        }
-                    },
-                    "required": ["code"]
-                }
-            }
-        }
-
+        return PYTHON_TOOL_DEFINITION
 
 
@@ -4,31 +4,119 @@ Provides web search capability for finding documentation and examples
 """
 
 import logging
-from typing import Dict, Any, List
-from ddgs import DDGS
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Worker threads search_many runs queries on (each keeps its own DDGS session)
+SEARCH_WORKERS = 4
+
+
+# Built once at import: the definition is static and identical for every instance
+WEB_SEARCH_TOOL_DEFINITION: Dict[str, Any] = {
+    "type": "function",
+    "function": {
+        "name": "search_web",
+        "strict": True,
+        "description": "Search the web using DuckDuckGo to find Python/pandas documentation, code examples, or solutions to data analysis problems. Use this when you need help with specific pandas operations, matplotlib visualizations, or data manipulation techniques.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Search query. Be specific and include relevant keywords like 'pandas', 'python', 'matplotlib', etc."
+                }
+            },
+            "required": ["query"],
+            "additionalProperties": False
+        }
+    }
+}
+
 
 class WebSearchTool:
     """
     Web search tool using DuckDuckGo API
     """
     
-    def __init__(self, max_results: int = 5):
+    def __init__(self, max_results: int = 5, cache_size: int = 256, cache_ttl: float = 3600,
+                 warmup: Optional[bool] = None):
         """
         Initialize the web search tool
         
         Args:
             max_results: Maximum number of search results to return (default: 5)
+            cache_size: Maximum number of cached queries (default: 256)
+            cache_ttl: Seconds a cached search result stays valid (default: 3600)
+            warmup: Run a throwaway search in the background so the first real query
+                does not pay DDGS initialization (default: on unless WEB_SEARCH_WARMUP=0)
         """
         self.max_results = max_results
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # (query, max_results) -> (expiry, result), least recently used first
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # One long-lived session per thread so HTTP/TLS state is reused across
+        # searches (a DDGS session is not safe to share between threads), created
+        # on first search so importing this module stays cheap
+        self._tls = threading.local()
+        # Long-lived pool for search_many, so its threads' sessions are reused too
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        
+        if warmup is None:
+            warmup = os.getenv("WEB_SEARCH_WARMUP", "1") != "0"
+        if warmup:
+            threading.Thread(target=self._warmup, name="ddgs-warmup", daemon=True).start()
+    
+    def _warmup(self) -> None:
+        """Import ddgs and run a throwaway query; results are discarded"""
+        try:
+            self._get_ddgs().text("pandas", max_results=1)
+        except Exception as e:
+            logger.debug("DDGS warmup failed: %s", e)
+    
+    def _get_ddgs(self):
+        """Return this thread's DDGS session, importing ddgs on first use"""
+        ddgs = getattr(self._tls, 'ddgs', None)
+        if ddgs is None:
+            from ddgs import DDGS
+            ddgs = self._tls.ddgs = DDGS()
+        return ddgs
+    
+    def _cache_get(self, key: Tuple[str, int]) -> Optional[Dict[str, Any]]:
+        """Return the cached result for key, or None if missing or expired"""
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expiry, cached = entry
+            if expiry < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return cached
+    
+    def _cache_put(self, key: Tuple[str, int], value: Dict[str, Any]) -> None:
+        """Store a result, evicting the least recently used entry when full"""
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
     
     def search(self, query: str) -> Dict[str, Any]:
         """
         Search the web using DuckDuckGo
         
+        Successful results are cached per (query, max_results) for cache_ttl seconds.
+        
         Args:
             query: Search query string
             
@@ -38,6 +126,12 @@ class WebSearchTool:
                 - results: list of search results
                 - error: str (if any)
         """
+        cache_key = (query.strip(), self.max_results)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.info("Search cache hit for: %s", query)
+            return dict(cached)
+        
         result = {
             'success': False,
             'results': [],
@@ -45,13 +139,12 @@ class WebSearchTool:
         }
         
         try:
-            logger.info(f"Searching for: {query}")
+            logger.info("Searching for: %s", query)
             
-            with DDGS() as ddgs:
-                search_results = list(ddgs.text(
-                    query,
-                    max_results=self.max_results
-                ))
+            search_results = list(self._get_ddgs().text(
+                query,
+                max_results=self.max_results
+            ))
             
             # Format results
             formatted_results = []
@@ -65,14 +158,32 @@ class WebSearchTool:
             
             result['results'] = formatted_results
             result['success'] = True
-            logger.info(f"Found {len(formatted_results)} results")
+            logger.info("Found %s results", len(formatted_results))
+            self._cache_put(cache_key, dict(result))
             
         except Exception as e:
             result['error'] = f"Search error: {str(e)}"
-            logger.error(f"Search error: {str(e)}")
+            logger.error("Search error: %s", e)
         
         return result
     
+    def search_many(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """
+        Run several searches concurrently
+        
+        Args:
+            queries: List of search query strings
+            
+        Returns:
+            List of search() results, in the same order as queries
+        """
+        if not queries:
+            return []
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+        return list(self._executor.map(self.search, queries))
+    
     def format_results(self, search_results: List[Dict[str, Any]]) -> str:
         """
         Format search results into a readable string
@@ -86,38 +197,20 @@ class WebSearchTool:
         if not search_results:
             return "No results found."
         
-        formatted = "Search Results:\n\n"
-        for res in search_results:
-            formatted += f"{res['position']}. {res['title']}\n"
-            formatted += f"   {res['snippet']}\n"
-            formatted += f"   URL: {res['url']}\n\n"
-        
-        return formatted
+        parts = ["Search Results:\n\n"]
+        parts.extend(
+            f"{res['position']}. {res['title']}\n   {res['snippet']}\n   URL: {res['url']}\n\n"
+            for res in search_results
+        )
+        return "".join(parts)
     
     def get_tool_definition(self) -> Dict[str, Any]:
         """
         Get the tool definition for OpenAI function calling
         
         Returns:
-            Tool definition dictionary
+            Tool definition dictionary (shared module constant, do not mutate)
         """
-        return {
-            "type": "function",
-            "function": {
-                "name": "search_web",
-                "description": "Search the web using DuckDuckGo to find Python/pandas documentation, code examples, or solutions to data analysis problems. Use this when you need help with specific pandas operations, matplotlib visualizations, or data manipulation techniques.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Search query. Be specific and include relevant keywords like 'pandas', 'python', 'matplotlib', etc."
-                        }
-                    },
-                    "required": ["query"]
-                }
-            }
-        }
-
+        return WEB_SEARCH_TOOL_DEFINITION
 
 
@@ -3,46 +3,25 @@ WebSearch Agent - MCP client using Agents SDK
 """
 
 import logging
+from typing import Union
 
-from agents import Agent
-from agents.mcp import MCPServerStdio, create_static_tool_filter
+from agents import Agent, Model
+from agents.mcp import MCPServer, create_static_tool_filter
 from agents.model_settings import ModelSettings
 
+from .prompts import WEB_SEARCH_INSTRUCTIONS
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-
-# System prompt for the WebSearchAgent
-WEB_SEARCH_INSTRUCTIONS = """You are a research assistant specialized in Python, pandas, matplotlib, and data analysis.
-
-Your role is to search the web for:
-- Documentation and API references
-- Solutions to Python/pandas errors
-- Code examples and best practices
-- Matplotlib/seaborn visualization techniques
 
-Use the MCP tool `search_web(query)` to find relevant information.
-
-Guidelines:
-- Provide concise, actionable summaries
-- Include concrete code snippets when available
-- Focus on authoritative sources (official docs, Stack Overflow, etc.)
-- Return your findings in a clear, structured format
-- The code you provide should be formatted as 
-```python 
-YOUR CODE HERE
-```
-"""
+logger = logging.getLogger(__name__)
 
 
-def create_web_search_agent(mcp_server: MCPServerStdio, model: str = "gpt-4o-mini") -> Agent:
+def create_web_search_agent(mcp_server: MCPServer, model: Union[str, Model] = "gpt-4o-mini") -> Agent:
     """
     Create an Agent SDK for web search
     
     Args:
-        mcp_server: MCP server already configured with search_web tool filter
-        model: OpenAI model to use
+        mcp_server: MCP server (or pooled view) exposing only search_web
+        model: OpenAI model name, or a Model bound to a shared client
     
     Returns:
         Agent configured for web search
@@ -51,8 +30,13 @@ def create_web_search_agent(mcp_server: MCPServerStdio, model: str = "gpt-4o-min
         name="WebSearchAgent",
         instructions=WEB_SEARCH_INSTRUCTIONS,
         mcp_servers=[mcp_server],
+        # Strict schemas let the API constrain tool-call generation to the schema
+        mcp_config={"convert_schemas_to_strict": True},
         model=model,
         model_settings=ModelSettings(tool_choice="required"),
+        # The search results are handed back verbatim: this skips the second
+        # LLM round trip that would only summarize them for the MasterAgent
+        tool_use_behavior="stop_on_first_tool",
     )
 
 
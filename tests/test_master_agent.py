@@ -0,0 +1,78 @@
+"""Tests for the MasterAgent result and agent caches"""
+
+import pytest
+
+from app_agents import master_agent, mcp_client
+from app_agents.mcp_client import InProcessMCPServer
+from app_agents.runtime import iterate_async
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(master_agent, "_result_cache", master_agent.OrderedDict())
+
+
+def test_result_cache_hit_returns_a_copy(tmp_path):
+    image = tmp_path / "chart.png"
+    image.write_bytes(b"png")
+    key = ("digest", "query", "model")
+    master_agent._result_cache_put(key, {"success": True, "images": [str(image)], "dataframe_path": None})
+
+    cached = master_agent._result_cache_get(key)
+    cached["success"] = False
+
+    assert master_agent._result_cache_get(key)["success"] is True
+
+
+def test_result_cache_evicts_entries_with_missing_files(tmp_path):
+    frame = tmp_path / "result.feather"
+    frame.write_bytes(b"feather")
+    key = ("digest", "query", "model")
+    master_agent._result_cache_put(key, {"success": True, "images": [], "dataframe_path": str(frame)})
+    frame.unlink()
+
+    assert master_agent._result_cache_get(key) is None
+    assert key not in master_agent._result_cache
+
+
+def test_result_cache_is_bounded():
+    for index in range(master_agent.RESULT_CACHE_SIZE + 1):
+        master_agent._result_cache_put(("digest", str(index), "model"), {"success": True})
+
+    assert len(master_agent._result_cache) == master_agent.RESULT_CACHE_SIZE
+    assert master_agent._result_cache_get(("digest", "0", "model")) is None
+
+
+def test_agents_are_bounded_per_api_key(monkeypatch):
+    monkeypatch.setattr(master_agent, "_agents", master_agent.OrderedDict())
+    python_server = InProcessMCPServer()
+    web_server = InProcessMCPServer()
+
+    first = master_agent.MasterAgent("sk-test-0")._get_agents(python_server, web_server)
+    assert master_agent.MasterAgent("sk-test-0")._get_agents(python_server, web_server) is first
+    for index in range(1, master_agent.AGENT_CACHE_SIZE + 1):
+        master_agent.MasterAgent(f"sk-test-{index}")._get_agents(python_server, web_server)
+
+    assert len(master_agent._agents) == master_agent.AGENT_CACHE_SIZE
+    assert all(key[0] != "sk-test-0" for key in master_agent._agents)
+    assert master_agent.MasterAgent("sk-test-0")._get_agents(python_server, web_server) is not first
+
+
+def test_analyze_stream_fast_path_result_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("WEB_SEARCH_WARMUP", "0")
+    monkeypatch.setattr(mcp_client, "MCP_TRANSPORT", "inprocess")
+    data = tmp_path / "sales.csv"
+    data.write_text("Region,Sales\nNorth,10\nSouth,20\nEast,30\n")
+    agent = master_agent.MasterAgent("sk-test")
+
+    events = list(iterate_async(agent.analyze_stream("show the first 2 rows", str(data))))
+
+    assert [event['type'] for event in events] == ['tool_start', 'final']
+    final = events[-1]
+    assert final['success'], final['error']
+    assert [row['Sales'] for row in final['dataframe']] == [10, 20]
+
+    cached = list(iterate_async(agent.analyze_stream("show the first 2 rows", str(data))))
+
+    assert [event['type'] for event in cached] == ['final']
+    assert cached[0]['dataframe'] == final['dataframe']
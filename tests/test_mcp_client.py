@@ -0,0 +1,27 @@
+"""Tests for the MCP client's duplicate-call guard"""
+
+import contextvars
+
+from app_agents import mcp_client
+
+
+def _in_new_scope(fn):
+    def run():
+        mcp_client.start_call_tracking()
+        return fn()
+    return contextvars.copy_context().run(run)
+
+
+def test_identical_code_calls_are_refused():
+    def calls():
+        arguments = {"code": "print(1)", "file_path": "data.csv"}
+        return [mcp_client._check_duplicate("execute_python_code", arguments)[0] for _ in range(2)]
+
+    assert _in_new_scope(calls) == [False, True]
+
+
+def test_search_calls_are_never_refused_as_duplicates():
+    def calls():
+        return [mcp_client._check_duplicate("search_web", {"query": "pandas merge"})[0] for _ in range(2)]
+
+    assert _in_new_scope(calls) == [False, False]
@@ -0,0 +1,165 @@
+"""Tests for the MCP server tool functions"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app_agents import mcp_server
+
+
+@pytest.fixture
+def output_dirs(tmp_path, monkeypatch):
+    search_dir = tmp_path / "search_cache"
+    search_dir.mkdir()
+    monkeypatch.setattr(mcp_server, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(mcp_server, "SEARCH_CACHE_DIR", str(search_dir))
+    return tmp_path, search_dir
+
+
+def _touch(path, age):
+    path.write_text("x")
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_cleanup_outputs_removes_expired_files(output_dirs):
+    output_dir, search_dir = output_dirs
+    old_png = _touch(output_dir / "old.png", mcp_server.OUTPUT_TTL + 60)
+    old_search = _touch(search_dir / "old.txt", mcp_server.OUTPUT_TTL + 60)
+    new_feather = _touch(output_dir / "new.feather", 0)
+    unrelated = _touch(output_dir / "notes.md", mcp_server.OUTPUT_TTL + 60)
+
+    assert mcp_server.cleanup_outputs(force=True) == 2
+    assert not old_png.exists() and not old_search.exists()
+    assert new_feather.exists() and unrelated.exists()
+
+
+def test_cleanup_outputs_is_throttled(output_dirs):
+    output_dir, _ = output_dirs
+    mcp_server.cleanup_outputs(force=True)
+    old_png = _touch(output_dir / "old.png", mcp_server.OUTPUT_TTL + 60)
+
+    assert mcp_server.cleanup_outputs() == 0
+    assert old_png.exists()
+
+
+class CountingTool:
+    """Stands in for the sandbox, counting executions"""
+
+    def __init__(self, image):
+        self.image = image
+        self.calls = 0
+
+    def execute(self, code, file_path):
+        self.calls += 1
+        return {'success': True, 'output': str(self.calls), 'error': '', 'dataframe': None,
+                'dataframe_path': None, 'images': [str(self.image)]}
+
+
+@pytest.fixture
+def counting_tool(tmp_path, monkeypatch, output_dirs):
+    image = tmp_path / "chart.png"
+    image.write_bytes(b"png")
+    tool = CountingTool(image)
+    monkeypatch.setattr(mcp_server, "_get_python_tool", lambda: tool)
+    monkeypatch.setattr(mcp_server, "_execution_cache", mcp_server.OrderedDict())
+    data = tmp_path / "data.csv"
+    data.write_text("a\n1\n")
+    return tool, str(data)
+
+
+def test_execution_cache_serves_repeated_code(counting_tool):
+    tool, data = counting_tool
+
+    first = mcp_server.execute_python_code("print(1)", data)
+    second = mcp_server.execute_python_code("print(1)", data)
+
+    assert tool.calls == 1
+    assert second == first and second is not first
+
+
+def test_execution_cache_misses_after_the_file_changes(counting_tool):
+    tool, data = counting_tool
+    mcp_server.execute_python_code("print(1)", data)
+    with open(data, "a") as f:
+        f.write("2\n")
+
+    mcp_server.execute_python_code("print(1)", data)
+
+    assert tool.calls == 2
+
+
+def test_execution_cache_skips_nondeterministic_code(counting_tool):
+    tool, data = counting_tool
+    for _ in range(2):
+        mcp_server.execute_python_code("df.sample(3)", data)
+
+    assert tool.calls == 2
+
+
+def test_execution_cache_evicts_entries_with_missing_files(counting_tool):
+    tool, data = counting_tool
+    mcp_server.execute_python_code("print(1)", data)
+    tool.image.unlink()
+
+    mcp_server.execute_python_code("print(1)", data)
+
+    assert tool.calls == 2
+
+
+def test_concurrent_executions_do_not_share_output_or_figures(output_dirs):
+    code = (
+        "import matplotlib.pyplot as plt\n"
+        "plt.figure()\n"
+        "plt.plot([{n}, {n}])\n"
+        "for _ in range(200000):\n"
+        "    pass\n"
+        "print('run {n}')\n"
+    )
+    data = output_dirs[0] / "data.csv"
+    data.write_text("a\n1\n")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(
+            lambda n: mcp_server.execute_python_code(code.format(n=n), str(data)), [1, 2]
+        ))
+
+    for n, result in enumerate(results, 1):
+        assert result['success'], result['error']
+        assert result['output'] == f"run {n}\n"
+        assert len(result['images']) == 1
+
+
+class BatchTool:
+    """Stands in for the sandbox, recording the batch timeout"""
+
+    timeout = 30
+
+    def execute_batch(self, snippets, file_path, stop_on_error, timeout):
+        self.batch_timeout = timeout
+        return {'success': True, 'output': '', 'error': '', 'dataframe': None,
+                'dataframe_path': None, 'images': [], 'completed': len(snippets)}
+
+
+@pytest.mark.parametrize("timeout_ms, expected", [(600000, 30), (5000, 5)])
+def test_batch_timeout_is_capped_by_the_sandbox_limit(monkeypatch, output_dirs, timeout_ms, expected):
+    tool = BatchTool()
+    monkeypatch.setattr(mcp_server, "_get_python_tool", lambda: tool)
+
+    assert mcp_server.batch_execute_python_code(["x = 1"], "data.csv", timeout_ms=timeout_ms)['success']
+    assert tool.batch_timeout == expected
+
+
+@pytest.mark.parametrize("timeout_ms", [0, -1])
+def test_batch_rejects_non_positive_timeouts(monkeypatch, output_dirs, timeout_ms):
+    tool = BatchTool()
+    monkeypatch.setattr(mcp_server, "_get_python_tool", lambda: tool)
+
+    result = mcp_server.batch_execute_python_code(["x = 1"], "data.csv", timeout_ms=timeout_ms)
+
+    assert not result['success']
+    assert 'timeout_ms' in result['error']
+    assert not hasattr(tool, 'batch_timeout')
@@ -0,0 +1,192 @@
+"""Tests for the Python sandbox tool"""
+
+import ast
+import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from app_agents.tools import python_tool
+from app_agents.tools.python_tool import PythonSandboxTool
+
+
+@pytest.fixture
+def tool(tmp_path):
+    sandbox = PythonSandboxTool(timeout=1, image_dir=str(tmp_path), dataframe_dir=str(tmp_path))
+    yield sandbox
+    sandbox.close()
+
+
+@pytest.mark.skipif(not python_tool._ALARM_AVAILABLE, reason="SIGALRM timeouts need POSIX interval timers")
+def test_alarm_timeout_not_swallowed_by_except_exception(tool):
+    code = (
+        "try:\n"
+        "    while True:\n"
+        "        pass\n"
+        "except Exception:\n"
+        "    print('caught')\n"
+    )
+    result = tool.execute(code)
+
+    assert not result['success']
+    assert result['error'].startswith('Execution timeout')
+    assert 'caught' not in result['output']
+
+
+
+@pytest.mark.parametrize("code", [
+    "print(pd.io.common.os.getcwd())",
+    "getattr(pd.io.common, '__dict' + '__')['os']",
+    "getattr(pd.io.common, 'o' + 's')",
+    "setattr(pd, '__class' + '__', None)",
+])
+def test_blocks_modules_reached_through_attributes(tool, code):
+    result = tool.execute(code)
+
+    assert not result['success']
+    assert 'not allowed' in result['error']
+
+
+def test_getattr_still_works_for_plain_attributes(tool):
+    result = tool.execute("df = pd.DataFrame({'a': [1, 2]})\nprint(getattr(df, 'shape'))")
+
+    assert result['success']
+    assert result['output'].strip() == '(2, 1)'
+
+
+def test_dataframe_file_is_capped(tool):
+    result = tool.execute(f"df = pd.DataFrame({{'a': range({python_tool.DATAFRAME_FILE_ROWS + 500})}})")
+
+    assert result['success']
+    assert len(result['dataframe']) == python_tool.PREVIEW_ROWS
+    assert len(pd.read_feather(result['dataframe_path'])) == python_tool.DATAFRAME_FILE_ROWS
+
+
+def test_batch_keeps_only_the_last_dataframe_file(tool, tmp_path):
+    result = tool.execute_batch([
+        "df = pd.DataFrame({'a': [1, 2, 3]})",
+        "df = df[df['a'] > 1]",
+    ])
+
+    assert result['success']
+    assert list(tmp_path.glob('*.feather')) == [pathlib.Path(result['dataframe_path'])]
+    assert len(pd.read_feather(result['dataframe_path'])) == 2
+
+
+def test_compiled_code_is_cached_and_bounded(tool):
+    for index in range(python_tool.CODE_CACHE_SIZE + 1):
+        assert tool.execute(f"x = {index}")['success']
+
+    assert len(tool._code_cache) == python_tool.CODE_CACHE_SIZE
+
+
+def test_no_run_starts_while_a_timed_out_run_is_still_executing(tool):
+    release = threading.Event()
+
+    def run(code):
+        namespace = tool._create_safe_globals(None)
+        namespace['wait'] = lambda: release.wait(10)
+        # Off the main thread, so the shared worker pool is used instead of SIGALRM
+        with ThreadPoolExecutor(max_workers=1) as caller:
+            return caller.submit(tool.execute, code, namespace=namespace, timeout=0.1).result()
+
+    try:
+        assert run("wait()\nprint('late')")['error'].startswith('Execution timeout')
+        assert run("print('next')")['error'].startswith('Sandbox busy')
+        assert tool.execute("print('next')")['error'].startswith('Sandbox busy')
+    finally:
+        release.set()
+
+    deadline = time.monotonic() + 5
+    while True:
+        result = run("print('next')")
+        if result['success']:
+            break
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert result['output'] == 'next\n'
+
+
+def test_imports_resolve_to_preloaded_modules(tool):
+    result = tool.execute(
+        "import matplotlib.pyplot as plt2\nimport numpy as np2\nprint(plt2 is plt, np2 is np)"
+    )
+
+    assert result['success']
+    assert result['output'].strip() == 'True True'
+
+
+@pytest.mark.parametrize("code", ["import os", "from subprocess import run", "import socket.socket"])
+def test_blocked_imports_are_rejected(tool, code):
+    result = tool.execute(code)
+
+    assert not result['success']
+    assert 'not allowed' in result['error']
+
+
+@pytest.mark.parametrize("code", [
+    "df = pd.read_excel(file_path)\nprint(df.describe())",
+    "result = {'total': df['Sales'].sum()}",
+])
+def test_clean_code_skips_validation(code):
+    assert not python_tool.needs_validation(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import os",
+    "x.__class__",
+    "eval('1')",
+    "ｅｖａｌ('1')",
+])
+def test_suspicious_code_needs_validation(code):
+    assert python_tool.needs_validation(code)
+
+
+def test_blocked_words_in_strings_pass_the_compiled_prefilter():
+    byte_code = compile("print('import os; eval(x)')  # __class__", '<sandbox>', 'exec')
+
+    assert not python_tool.has_suspicious_names(byte_code)
+
+
+@pytest.mark.parametrize("code", [
+    "eval('1')",
+    "def f():\n    return open('x')",
+    "[c.__subclasses__() for c in ()]",
+])
+def test_blocked_names_in_nested_code_are_suspicious(code):
+    assert python_tool.has_suspicious_names(compile(code, '<sandbox>', 'exec'))
+
+
+@pytest.mark.parametrize("code, message", [
+    ("eval('1')", "Use of 'eval' is not allowed"),
+    ("ｅｖａｌ('1')", "Use of 'eval' is not allowed"),
+    ("().__class__.__bases__", "Access to '__class__' is not allowed"),
+    ("import subprocess", "Import of 'subprocess' is not allowed"),
+    ("from os import path", "Import from 'os' is not allowed"),
+])
+def test_validate_code_reports_blocked_operations(code, message):
+    assert message in python_tool.validate_code(ast.parse(code))
+
+
+def test_validate_code_allows_analysis_code():
+    code = "df = pd.read_csv(file_path)\nresult = df.groupby('Region')['Sales'].sum()\nprint(result.__repr__())"
+
+    assert python_tool.validate_code(ast.parse(code)) == []
+
+
+def test_rejected_code_is_not_run(tool):
+    result = tool.execute("print('ran')\neval('1')")
+
+    assert not result['success']
+    assert result['output'] == ''
+    assert 'Security validation failed' in result['error']
+
+
+def test_preview_keeps_float_precision(tool):
+    result = tool.execute("df = pd.DataFrame({'a': [1234.56789012345, 0.000123456789012]})")
+
+    assert result['success']
+    assert [row['a'] for row in result['dataframe']] == [1234.56789012345, 0.000123456789012]
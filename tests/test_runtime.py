@@ -0,0 +1,80 @@
+"""Tests for the shared async runtime"""
+
+import asyncio
+import contextvars
+import time
+
+import pytest
+
+from app_agents import excel_agent, mcp_client, runtime
+from app_agents.runtime import iterate_async
+
+_value: contextvars.ContextVar = contextvars.ContextVar("_value", default=None)
+
+
+def test_iterate_async_keeps_context_across_yields():
+    async def agen():
+        _value.set("collected")
+        yield "first"
+        await asyncio.sleep(0)
+        yield _value.get()
+
+    assert list(iterate_async(agen())) == ["first", "collected"]
+
+
+def test_iterate_async_raises_generator_errors():
+    async def agen():
+        yield 1
+        raise ValueError("boom")
+
+    items = []
+    with pytest.raises(ValueError, match="boom"):
+        for item in iterate_async(agen()):
+            items.append(item)
+    assert items == [1]
+
+
+def test_iterate_async_runs_cleanup_when_stopped_early():
+    cleaned = []
+
+    async def agen():
+        try:
+            while True:
+                yield 1
+                await asyncio.sleep(0.01)
+        finally:
+            cleaned.append(True)
+
+    for _ in iterate_async(agen()):
+        break
+    assert cleaned == [True]
+
+
+def test_iterate_async_keeps_analysis_scopes_across_yields():
+    async def agen():
+        mcp_client.start_call_tracking()
+        results = excel_agent.start_result_collection()
+        yield "started"
+        await asyncio.sleep(0)
+        yield excel_agent._tool_results.get() is results
+        yield mcp_client._check_duplicate("execute_python_code", {"code": "1"})[0]
+        yield mcp_client._check_duplicate("execute_python_code", {"code": "1"})[0]
+
+    assert list(iterate_async(agen())) == ["started", True, False, True]
+
+
+def test_openai_clients_are_bounded_and_evicted_clients_closed(monkeypatch):
+    monkeypatch.setattr(runtime, "_clients", runtime.OrderedDict())
+    monkeypatch.setattr(runtime, "CLIENT_CLOSE_DELAY", 0)
+
+    first = runtime.get_openai_client("sk-test-0")
+    assert runtime.get_openai_client("sk-test-0") is first
+    for index in range(1, runtime.CLIENT_CACHE_SIZE + 1):
+        runtime.get_openai_client(f"sk-test-{index}")
+
+    assert len(runtime._clients) == runtime.CLIENT_CACHE_SIZE
+    assert all("sk-test" not in key for key in runtime._clients)
+    deadline = time.monotonic() + 5
+    while not first.is_closed() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert first.is_closed()
@@ -0,0 +1,48 @@
+"""Tests for the web search tool"""
+
+import sys
+import threading
+import types
+
+import pytest
+
+from app_agents.tools.web_search_tool import WebSearchTool
+
+
+class FakeDDGS:
+    """Records the threads each session is used from"""
+
+    instances = []
+
+    def __init__(self):
+        self.threads = set()
+        self.calls = 0
+        FakeDDGS.instances.append(self)
+
+    def text(self, query, max_results):
+        self.threads.add(threading.get_ident())
+        self.calls += 1
+        return [{'title': query, 'body': 'body', 'href': 'https://example.com'}]
+
+
+@pytest.fixture
+def tool(monkeypatch):
+    FakeDDGS.instances = []
+    monkeypatch.setitem(sys.modules, 'ddgs', types.SimpleNamespace(DDGS=FakeDDGS))
+    return WebSearchTool(warmup=False)
+
+
+def test_search_many_keeps_sessions_per_thread(tool):
+    queries = [f"query {index}" for index in range(20)]
+
+    results = tool.search_many(queries)
+
+    assert [result['results'][0]['title'] for result in results] == queries
+    assert all(len(session.threads) == 1 for session in FakeDDGS.instances)
+
+
+def test_search_results_are_cached(tool):
+    tool.search("pandas merge")
+    tool.search("pandas merge")
+
+    assert [session.calls for session in FakeDDGS.instances] == [1]